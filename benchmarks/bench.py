@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# Parsing and analysis benchmarks over synthetic histories. Every stage is timed on its own:
+# parsing each format, extract_command, the filters, alias resolution, aggregation, each
+# report and correlations. Results are written as JSON so runs can be kept and compared with
+# --compare; a short summary goes to stderr.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import freq
+from generate_history import FORMATS, DEFAULT_START, write_history
+
+# Matches the aliases the generator's vocabulary uses
+ALIASES = {'gs': 'git status', 'll': 'ls -la', 'g': 'git'}
+TARGET_COMMAND = 'git'
+EXCLUDE = ['ls', 'cd', 'vim']
+
+def consume(history):
+    if isinstance(history, freq.HistoryStore):
+        return len(history)
+    return sum(1 for _ in history)
+
+def run_quietly(func, *args):
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        func(*args)
+
+def time_benchmark(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, timings
+
+def history_benchmarks(paths, store, date_filter):
+    # (name, callable returning the number of records produced, where there is one)
+    zsh_file = paths['zsh']
+    zsh_parser = freq.get_history_parser('zsh')
+    benchmarks = []
+    for history_format, path in paths.items():
+        parser = freq.get_history_parser(history_format)
+        benchmarks += [
+            (f"parse.{history_format}", lambda parser=parser, path=path: consume(parser(path))),
+            (f"parse.{history_format}.full_command",
+             lambda parser=parser, path=path: consume(parser(path, full_command=True))),
+            (f"parse.{history_format}.cached",
+             lambda shell_type=history_format, path=path: consume(freq.parse_history(path, shell_type=shell_type))),
+        ]
+
+    raw_commands = [command for command, timestamp, duration in zsh_parser(zsh_file, full_command=True)]
+    alias_counts = Counter()
+    benchmarks += [
+        ("extract_command", lambda: sum(1 for command in map(freq.extract_command, raw_commands) if command)),
+        ("filter.date.early", lambda: consume(zsh_parser(zsh_file, date_filter=date_filter))),
+        ("filter.date.stream", lambda: consume(freq.filter_by_date(iter(store), date_filter))),
+        ("filter.date.store", lambda: consume(freq.filter_by_date(store, date_filter))),
+        ("filter.command.early", lambda: consume(zsh_parser(zsh_file, command_filter=TARGET_COMMAND))),
+        ("filter.command.stream", lambda: consume(freq.filter_by_command(iter(store), TARGET_COMMAND))),
+        ("filter.command.store", lambda: consume(freq.filter_by_command(store, TARGET_COMMAND))),
+        ("filter.exclude.stream", lambda: consume(freq.filter_commands(iter(store), EXCLUDE))),
+        ("filter.exclude.store", lambda: consume(freq.filter_commands(store, EXCLUDE))),
+        ("aliases.stream", lambda: consume(freq.resolve_aliases(iter(store), ALIASES, alias_counts=alias_counts))),
+        ("aliases.store", lambda: consume(freq.resolve_aliases(store, ALIASES, alias_counts=alias_counts))),
+        ("aggregate", lambda: freq.aggregate_history(store, daily=False).total),
+        ("aggregate.daily", lambda: freq.aggregate_history(store).total),
+        ("aggregate.stream", lambda: freq.aggregate_history(iter(store), daily=False).total),
+        ("report.basic", lambda: run_quietly(freq.show_basic_analysis, store, 10)),
+        ("report.advanced", lambda: run_quietly(freq.show_advanced_analysis, store, 15)),
+        ("report.command", lambda: run_quietly(freq.show_command_analysis, store, TARGET_COMMAND, 20, True)),
+        ("report.json", lambda: run_quietly(freq.write_report, freq.advanced_report(store, 15), 'json')),
+        ("correlations", lambda: sum(freq.get_command_correlations(store, TARGET_COMMAND).values())),
+    ]
+    return benchmarks
+
+def compare(results, config, baseline_path):
+    with open(baseline_path) as f:
+        baseline_report = json.load(f)
+    baseline = {result['name']: result for result in baseline_report['results']}
+    if baseline_report['config'] != config:
+        print(f"Note: baseline was run with {baseline_report['config']}", file=sys.stderr)
+    print(f"\n{'benchmark':<38} {'baseline':>10} {'now':>10} {'speedup':>8}", file=sys.stderr)
+    for result in results:
+        before = baseline.get(result['name'])
+        if before:
+            print(f"{result['name']:<38} {before['best']:>9.4f}s {result['best']:>9.4f}s "
+                  f"{before['best'] / result['best']:>7.2f}x", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark freq parsing and analysis on synthetic histories')
+    parser.add_argument('-n', '--lines', type=int, default=200000, help='Entries per history (default: 200000)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Timed runs per benchmark (default: 3)')
+    parser.add_argument('--commands', type=int, default=500, help='Distinct command vocabulary size (default: 500)')
+    parser.add_argument('--seed', type=int, default=0, help='Generator seed (default: 0)')
+    parser.add_argument('--backend', choices=['auto', 'python', 'numpy'], default='auto',
+                        help='Analysis backend, as FREQ_BACKEND (default: auto)')
+    parser.add_argument('-k', '--filter', help='Only run benchmarks whose name contains this')
+    parser.add_argument('-o', '--output', help='Write the JSON results to a file instead of stdout')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare against an earlier JSON result')
+    args = parser.parse_args()
+
+    os.environ['FREQ_BACKEND'] = args.backend
+    workdir = tempfile.mkdtemp(prefix='freq-bench-')
+    os.environ['XDG_CACHE_HOME'] = os.path.join(workdir, 'cache')
+    try:
+        paths = {}
+        for history_format in FORMATS:
+            paths[history_format] = os.path.join(workdir, f"history.{history_format}")
+            with open(paths[history_format], 'wb', buffering=1 << 20) as f:
+                write_history(f, history_format, args.lines, vocabulary_size=args.commands, seed=args.seed)
+            # Builds the parse cache the .cached benchmarks read
+            consume(freq.parse_history(paths[history_format], shell_type=history_format))
+
+        store = freq.HistoryStore.from_records(freq.parse_zsh_history(paths['zsh']))
+        # The middle tenth of the generated time span
+        span = store.timestamps[-1] - DEFAULT_START
+        date_filter = (DEFAULT_START + span * 45 // 100, DEFAULT_START + span * 55 // 100)
+
+        results = []
+        for name, func in history_benchmarks(paths, store, date_filter):
+            if args.filter and args.filter not in name:
+                continue
+            records, timings = time_benchmark(func, args.repeat)
+            best = min(timings)
+            results.append({
+                'name': name,
+                'entries': args.lines,
+                'records': records,
+                'best': best,
+                'median': statistics.median(timings),
+                'runs': timings,
+                'entries_per_second': args.lines / best if best else None,
+            })
+            print(f"{name:<38} {best:>9.4f}s  ({args.lines / best:>12,.0f} entries/s)", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    try:
+        commit = subprocess.run(['git', '-C', ROOT, 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    report = {
+        'commit': commit,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': args.backend,
+        'numpy': freq.load_numpy() is not None,
+        'config': {'lines': args.lines, 'repeat': args.repeat, 'commands': args.commands, 'seed': args.seed},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if args.compare:
+        compare(results, report['config'], args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+# Deterministic synthetic shell histories for benchmarking: the same seed and options always
+# produce the same bytes. Commands follow a Zipfian distribution over a vocabulary of real
+# tools padded with synthetic ones, and a small share of entries are multiline commands or
+# the kinds of malformed lines real history files pick up.
+
+import argparse
+import random
+import sys
+
+FORMATS = ['zsh', 'bash_timestamped', 'bash']
+DEFAULT_START = 1700000000
+
+# Real tools first, so they take the top Zipf ranks, each with a few typical invocations
+COMMON_COMMANDS = [
+    ('git', ['status', 'diff', 'log --oneline', 'add -p', 'commit -m "wip"', 'push', 'pull --rebase',
+             'checkout main', 'rebase -i HEAD~3', 'show HEAD']),
+    ('ls', ['', '-la', '-lh', '-R src']),
+    ('cd', ['..', '~', 'src', '/tmp', '-']),
+    ('vim', ['freq.py', 'README.md', '~/.zshrc', 'Makefile']),
+    ('gs', ['']),
+    ('python3', ['freq.py', '-m pytest', '-c "import sys; print(sys.path)"', 'manage.py runserver']),
+    ('make', ['', 'test', 'clean', '-j8']),
+    ('docker', ['ps', 'compose up -d', 'logs -f web', 'build -t app .', 'exec -it web bash']),
+    ('grep', ['-rn TODO .', '-i error app.log', '-v "^#" config']),
+    ('ll', ['']),
+    ('npm', ['install', 'run build', 'test', 'run dev']),
+    ('cat', ['README.md', '/etc/hosts', 'package.json']),
+    ('ssh', ['prod', 'staging', 'user@10.0.0.5']),
+    ('kubectl', ['get pods', 'describe pod web-0', 'logs -f deploy/api', 'apply -f k8s/']),
+    ('g', ['status', 'log']),
+    ('sudo', ['apt update', 'systemctl restart nginx', 'vim /etc/hosts']),
+    ('man', ['zsh', 'git-rebase']),
+    ('curl', ['-s localhost:8080/health', '-I https://example.com']),
+    ('tail', ['-f /var/log/syslog', '-n 100 app.log']),
+    ('find', ['. -name "*.py"', '/tmp -mtime +7 -delete']),
+    ('echo', ['$PATH', '"hello"']),
+    ('export', ['PATH="$HOME/bin:$PATH"', 'EDITOR=vim']),
+    ('htop', ['']),
+    ('cargo', ['build --release', 'test', 'run']),
+    ('go', ['test ./...', 'build', 'mod tidy']),
+    ('rm', ['-rf build', 'tmp.txt']),
+    ('mkdir', ['-p build', 'tmp']),
+    ('cp', ['a.txt b.txt', '-r src dst']),
+    ('mv', ['old new']),
+    ('tmux', ['attach', 'new -s work']),
+]
+
+MULTILINE_COMMANDS = [
+    ['for f in *.log; do', '  gzip "$f"', 'done'],
+    ['while true; do', '  curl -s localhost:8080/health', '  sleep 5', 'done'],
+    ['git commit -m "first line', '', 'more detail"'],
+    ['cat <<EOF > notes.txt', 'todo', 'EOF'],
+]
+
+# Lines real histories accumulate: broken LS_COLORS pastes, corrupted headers, stray bytes
+MALFORMED_LINES = [
+    b"00;35' export LS_COLORS=di=01;34",
+    b"35'",
+    b"1234' echo broken",
+    b": notatimestamp:0;ls",
+    b": 1700000000;missing duration",
+    b"\xff\xfe\x83garbage",
+    b"",
+]
+
+def build_vocabulary(size):
+    commands = []
+    for name, arguments in COMMON_COMMANDS:
+        commands.append([f"{name} {args}".rstrip() for args in arguments])
+    for i in range(len(commands), size):
+        commands.append([f"tool{i}", f"tool{i} --verbose", f"tool{i} run job{i % 17}"])
+    return commands[:size]
+
+def zipf_weights(size, exponent):
+    weights = []
+    total = 0.0
+    for rank in range(1, size + 1):
+        total += 1.0 / rank ** exponent
+        weights.append(total)
+    return weights
+
+def generate_entries(lines, vocabulary_size=500, exponent=1.1, multiline_rate=0.002, malformed_rate=0.001,
+                     seed=0, start=DEFAULT_START):
+    # Yields (timestamp, duration, command lines, malformed line) for `lines` entries
+    rng = random.Random(seed)
+    vocabulary = build_vocabulary(vocabulary_size)
+    cum_weights = zipf_weights(len(vocabulary), exponent)
+    timestamp = start
+    batch = 4096
+    emitted = 0
+    while emitted < lines:
+        size = min(batch, lines - emitted)
+        picks = rng.choices(vocabulary, cum_weights=cum_weights, k=size)
+        for variants in picks:
+            # Sessions: mostly seconds apart, with the occasional overnight gap
+            timestamp += rng.randint(1, 90) if rng.random() < 0.98 else rng.randint(3600, 50000)
+            duration = int(rng.expovariate(0.5)) if rng.random() < 0.3 else 0
+            roll = rng.random()
+            if roll < malformed_rate:
+                yield timestamp, duration, None, rng.choice(MALFORMED_LINES)
+            elif roll < malformed_rate + multiline_rate:
+                yield timestamp, duration, rng.choice(MULTILINE_COMMANDS), None
+            else:
+                yield timestamp, duration, [rng.choice(variants)], None
+        emitted += size
+
+def format_entry(output_format, timestamp, duration, command_lines, malformed):
+    if malformed is not None:
+        return malformed + b"\n"
+    if output_format == 'zsh':
+        # zsh escapes the newlines of a multiline command with a backslash
+        command = "\\\n".join(command_lines)
+        return f": {timestamp}:{duration};{command}\n".encode('utf-8')
+    text = "\n".join(command_lines) + "\n"
+    if output_format == 'bash_timestamped':
+        text = f"#{timestamp}\n" + text
+    return text.encode('utf-8')
+
+def write_history(output, output_format, lines, **options):
+    for entry in generate_entries(lines, **options):
+        output.write(format_entry(output_format, *entry))
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a deterministic synthetic shell history')
+    parser.add_argument('format', choices=FORMATS, help='History format to write')
+    parser.add_argument('output', help='File to write, or - for stdout')
+    parser.add_argument('-n', '--lines', type=int, default=100000, help='Number of entries (default: 100000)')
+    parser.add_argument('--commands', type=int, default=500, help='Distinct command vocabulary size (default: 500)')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of command popularity (default: 1.1)')
+    parser.add_argument('--multiline-rate', type=float, default=0.002,
+                        help='Share of multiline entries (default: 0.002)')
+    parser.add_argument('--malformed-rate', type=float, default=0.001,
+                        help='Share of malformed lines (default: 0.001)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    parser.add_argument('--start', type=int, default=DEFAULT_START, help='First timestamp (default: Nov 2023)')
+    args = parser.parse_args()
+
+    options = dict(vocabulary_size=args.commands, exponent=args.zipf, multiline_rate=args.multiline_rate,
+                   malformed_rate=args.malformed_rate, seed=args.seed, start=args.start)
+    if args.output == '-':
+        write_history(sys.stdout.buffer, args.format, args.lines, **options)
+    else:
+        with open(args.output, 'wb', buffering=1 << 20) as f:
+            write_history(f, args.format, args.lines, **options)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# Startup-time check: times `freq` and `freq -n 5` on an empty and a small history, run the
+# way install.sh installs it (cached bytecode behind a launcher), and fails when a case's
+# median wall-clock time exceeds the bare interpreter's startup by more than the budget.
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+FREQ_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'freq.py')
+
+# Same launcher install.sh writes to /usr/local/bin/freq
+LAUNCHER = """\
+from importlib.machinery import SourceFileLoader
+__file__ = {path!r}
+exec(SourceFileLoader(__name__, __file__).get_code(__name__))
+"""
+
+SMALL_HISTORY_COMMANDS = ['git status', 'git commit -m "wip"', 'ls -la', 'cd ..', 'vim freq.py',
+                          'make test', 'docker ps', 'grep -r TODO .', 'python3 freq.py -n 5', 'ssh prod']
+
+def write_small_history(path, records=1000):
+    rng = random.Random(0)
+    timestamp = 1700000000
+    with open(path, 'w') as f:
+        for _ in range(records):
+            timestamp += rng.randint(1, 600)
+            f.write(f": {timestamp}:0;{rng.choice(SMALL_HISTORY_COMMANDS)}\n")
+
+def time_command(argv, env, runs, warmup=2):
+    # Warm-up runs build the parse cache and bytecode, as any earlier use of freq would have
+    timings = []
+    for i in range(warmup + runs):
+        start = time.perf_counter()
+        subprocess.run(argv, env=env, stdout=subprocess.DEVNULL, check=True)
+        if i >= warmup:
+            timings.append(time.perf_counter() - start)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description='Check freq startup time against a budget')
+    parser.add_argument('-r', '--runs', type=int, default=20, help='Timed runs per case (default: 20)')
+    parser.add_argument('--budget', type=float, default=50.0,
+                        help='Allowed milliseconds over bare interpreter startup (default: 50)')
+    parser.add_argument('--script', action='store_true',
+                        help='Run freq.py directly instead of through the installed launcher')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='freq-startup-')
+    try:
+        home = os.path.join(workdir, 'home')
+        lib = os.path.join(workdir, 'lib')
+        os.makedirs(home)
+        os.makedirs(lib)
+        env = dict(os.environ, HOME=home, SHELL='/bin/zsh',
+                   XDG_CACHE_HOME=os.path.join(workdir, 'cache'),
+                   XDG_RUNTIME_DIR=os.path.join(workdir, 'run'))
+
+        if args.script:
+            freq = [sys.executable, FREQ_SCRIPT]
+        else:
+            freq_path = os.path.join(lib, 'freq.py')
+            shutil.copy(FREQ_SCRIPT, freq_path)
+            subprocess.run([sys.executable, '-m', 'compileall', '-q', lib], check=True)
+            launcher = os.path.join(workdir, 'freq')
+            with open(launcher, 'w') as f:
+                f.write(LAUNCHER.format(path=freq_path))
+            freq = [sys.executable, launcher]
+
+        timings = time_command([sys.executable, '-c', 'pass'], env, args.runs)
+        baseline = statistics.median(timings)
+        print(f"{'python -c pass':<24} {baseline * 1000:7.1f} ms  (min {min(timings) * 1000:.1f} ms)")
+
+        history_file = os.path.join(home, '.zsh_history')
+        failed = False
+        for history in ['empty', 'small']:
+            if history == 'empty':
+                open(history_file, 'w').close()
+            else:
+                write_small_history(history_file)
+            for extra in [[], ['-n', '5']]:
+                label = ' '.join(['freq'] + extra) + f" ({history})"
+                timings = time_command(freq + extra, env, args.runs)
+                median = statistics.median(timings)
+                overhead = (median - baseline) * 1000
+                status = 'ok' if overhead <= args.budget else 'OVER BUDGET'
+                failed = failed or overhead > args.budget
+                print(f"{label:<24} {median * 1000:7.1f} ms  "
+                      f"(+{overhead:.1f} ms, min {min(timings) * 1000:.1f} ms)  {status}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failed:
+        print(f"Startup exceeded the {args.budget:g} ms budget")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,516 @@
 #!/usr/bin/env python3
 
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import Counter, defaultdict
-import datetime
-import re
+from itertools import chain, compress
+from operator import itemgetter
 import os
-import argparse
+import stat
 import sys
+import time
+try:
+    # Built in; hashlib itself would also load OpenSSL's hashes, which startup doesn't need
+    from _blake2 import blake2b
+except ImportError:
+    from hashlib import blake2b
+
+CACHE_VERSION = 5
+INDEX_BLOCK_RECORDS = 4096
+RANGE_PARSE_BLOCKS = 2  # date ranges within this many index blocks are parsed rather than rolled up
+DELTA_SEGMENTS = 64       # appends kept in the delta file before the cache is rewritten whole...
+DELTA_RECORDS = 1 << 16   # ...or records, whichever comes first
+ROLLUP_LAG_RECORDS = 1 << 14  # records a loaded rollup may catch up on in memory before it is saved
+CACHE_STATE = ['version', 'path', 'inode', 'device', 'size', 'mtime', 'offset', 'fingerprint', 'compressed']
+NO_TIMESTAMP = -1 << 63  # cached for commands without a timestamp, which are dated when read
+MAX_TIMESTAMP = 253402128000  # 9999-12-30, the last day datetime can bound in every time zone
+NUMPY_MIN_RECORDS = 50000
+APPROX_CAPACITY = 1000
+COUNT_MIN_WIDTH = 2719  # e / 0.001: over-estimates by at most 0.1% of all records...
+COUNT_MIN_DEPTH = 5     # ...with probability 1 - e^-5, about 99.3%
+HLL_PRECISION = 12      # 4096 one-byte registers, about 1.6% standard error
+DISTINCT_SAMPLE_SIZE = 512
+FOLLOW_INTERVAL = 1.0
+READ_BUFFER_SIZE = 1 << 20
+DAEMON_ENVIRONMENT = ['SHELL', 'HOME', 'TZ', 'COLUMNS', 'XDG_CACHE_HOME', 'FREQ_BACKEND']  # forwarded per query
+ALIAS_FILES = ["~/.aliases", "~/.bash_aliases", "~/.zshrc", "~/.bashrc"]
+REPORT_FIELDS = ['section', 'rank', 'user', 'command', 'date', 'metric', 'count', 'value']
+FLEET_HISTORY_FILES = ['.zsh_history', '.histfile', '.bash_history']
+COMPRESSION_MAGIC = [(b'\x1f\x8b', 'gzip'), (b'\xfd7zXZ\x00', 'lzma'), (b'BZh', 'bz2')]
+
+_numpy = None
+_cache_memo = None  # cache path -> (file mtime, cache); only the --serve daemon keeps caches in memory
+_serving = False
+_profiler = None  # the active Profiler while a --profile run is in progress
+
+class HistoryStore:
+    # Columnar history: command strings are interned to integer IDs and
+    # (command ID, timestamp, duration) records are kept in parallel typed arrays.
+    def __init__(self, commands=None, ids=None, timestamps=None, durations=None):
+        self.commands = commands if commands is not None else []
+        self.command_ids = {command: i for i, command in enumerate(self.commands)}
+        self.ids = ids if ids is not None else array('I')
+        self.timestamps = timestamps if timestamps is not None else array('q')
+        self.durations = durations if durations is not None else array('I', bytes(4 * len(self.ids)))
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __iter__(self):
+        return zip(map(self.commands.__getitem__, self.ids), self.timestamps, self.durations)
+    
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self.commands[self.ids[index]], self.timestamps[index], self.durations[index]
+        return self._derive(self.ids[index], self.timestamps[index], self.durations[index])
+    
+    def __getstate__(self):
+        return self.commands, self.ids, self.timestamps, self.durations
+    
+    def __setstate__(self, state):
+        self.__init__(*state)
+    
+    def _derive(self, ids, timestamps, durations):
+        # Derived stores share the (append-only) vocabulary with their parent
+        derived = HistoryStore.__new__(HistoryStore)
+        derived.commands = self.commands
+        derived.command_ids = self.command_ids
+        derived.ids = ids
+        derived.timestamps = timestamps
+        derived.durations = durations
+        return derived
+    
+    def intern(self, command):
+        command_id = self.command_ids.get(command)
+        if command_id is None:
+            command_id = len(self.commands)
+            self.command_ids[command] = command_id
+            self.commands.append(command)
+        return command_id
+    
+    def append(self, command, timestamp, duration=0):
+        self.ids.append(self.intern(command))
+        self.timestamps.append(timestamp)
+        self.durations.append(duration)
+    
+    def extend(self, other):
+        translation = [self.intern(command) for command in other.commands]
+        self.ids.extend(map(translation.__getitem__, other.ids))
+        self.timestamps.extend(other.timestamps)
+        self.durations.extend(other.durations)
+    
+    @classmethod
+    def from_records(cls, records):
+        if isinstance(records, HistoryStore):
+            return records
+        store = cls()
+        intern = store.intern
+        ids = store.ids
+        timestamps = store.timestamps
+        durations = store.durations
+        for command, timestamp, duration in records:
+            ids.append(intern(command))
+            timestamps.append(timestamp)
+            durations.append(duration)
+        return store
+    
+    def copy(self):
+        return HistoryStore(list(self.commands), array('I', self.ids), array('q', self.timestamps),
+                            array('I', self.durations))
+    
+    def select(self, selectors):
+        return self._derive(array('I', compress(self.ids, selectors)),
+                            array('q', compress(self.timestamps, selectors)),
+                            array('I', compress(self.durations, selectors)))
+    
+    def select_commands(self, predicate):
+        keep = [1 if predicate(command) else 0 for command in self.commands]
+        if all(keep):
+            return self
+        return self.select(bytes(map(keep.__getitem__, self.ids)))
+    
+    def select_time_range(self, start_time=None, end_time=None):
+        if start_time and end_time:
+            selectors = bytes(start_time <= t <= end_time for t in self.timestamps)
+        elif start_time:
+            selectors = bytes(t >= start_time for t in self.timestamps)
+        elif end_time:
+            selectors = bytes(t <= end_time for t in self.timestamps)
+        else:
+            return self
+        return self.select(selectors)
+    
+    def map_commands(self, func):
+        mapped = HistoryStore()
+        translation = [mapped.intern(func(command)) for command in self.commands]
+        mapped.ids = array('I', map(translation.__getitem__, self.ids))
+        mapped.timestamps = self.timestamps
+        mapped.durations = self.durations
+        return mapped
+    
+    def count_commands(self):
+        # Counter preserves first-occurrence order, so ties rank like a plain Counter
+        commands = self.commands
+        return Counter({commands[command_id]: count for command_id, count in Counter(self.ids).items()})
+
+
+class HistoryStats:
+    # Aggregates produced by a single pass over the history; the reports only format these
+    def __init__(self):
+        self.command_counts = Counter()
+        self.total = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.daily_counts = {}
+        self.command_durations = Counter()
+        self.correlations = None
+        self.ranker = None
+        self.sketch = None
+    
+    def __len__(self):
+        return self.total
+    
+    def most_common(self, n=None):
+        if self.sketch is not None:
+            return self.sketch.most_common(n)
+        if self.ranker is not None:
+            return self.ranker(n)
+        return self.command_counts.most_common(n)
+    
+    def count_error(self, command):
+        # How far a reported count may be above the true one; exact counts have none
+        return self.sketch.error(command) if self.sketch is not None else 0
+    
+    def merge(self, other):
+        # Partials must be merged in file order to keep first-occurrence tie ranking
+        self.ranker = None
+        self.command_counts.update(other.command_counts)
+        self.total += other.total
+        if other.first_timestamp is not None:
+            if self.first_timestamp is None or other.first_timestamp < self.first_timestamp:
+                self.first_timestamp = other.first_timestamp
+            if self.last_timestamp is None or other.last_timestamp > self.last_timestamp:
+                self.last_timestamp = other.last_timestamp
+        for day, count in other.daily_counts.items():
+            self.daily_counts[day] = self.daily_counts.get(day, 0) + count
+        self.command_durations.update(other.command_durations)
+        if other.sketch is not None:
+            if self.sketch is None:
+                self.sketch = CommandSketch(other.sketch.heavy_hitters.capacity)
+            self.sketch.merge(other.sketch)
+        return self
+    
+    @property
+    def unique_commands(self):
+        if self.sketch is not None:
+            return self.sketch.unique_commands()
+        return len(self.command_counts)
+    
+    @property
+    def single_use_commands(self):
+        if self.sketch is not None:
+            return self.sketch.single_use_commands()
+        return sum(1 for count in self.command_counts.values() if count == 1)
+
+
+class RollupTable:
+    # Per-command sums for each time bucket, kept flat so it pickles and loads quickly: bucket
+    # keys ascending, each bucket's (command ID, value) entries contiguous and in the order the
+    # commands first occurred in the bucket
+    def __init__(self):
+        self.keys = array('q')
+        self.starts = array('Q')
+        self.ids = array('I')
+        self.values = array('Q')
+    
+    def __getstate__(self):
+        return self.keys, self.starts, self.ids, self.values
+    
+    def __setstate__(self, state):
+        self.keys, self.starts, self.ids, self.values = state
+    
+    def bounds(self, position):
+        end = self.starts[position + 1] if position + 1 < len(self.starts) else len(self.ids)
+        return self.starts[position], end
+    
+    def positions(self, first_key, last_key):
+        return bisect_left(self.keys, first_key), bisect_right(self.keys, last_key)
+    
+    def total(self, position):
+        start, end = self.bounds(position)
+        return sum(self.values[start:end])
+    
+    def merge(self, buckets):
+        # Buckets from the first one touched on are rewritten; for a time-ordered history
+        # that is only the last bucket, which the new records may have continued
+        if not buckets:
+            return
+        position = bisect_left(self.keys, min(buckets))
+        merged = {}
+        for p in range(position, len(self.keys)):
+            start, end = self.bounds(p)
+            merged[self.keys[p]] = dict(zip(self.ids[start:end], self.values[start:end]))
+        for key, bucket in buckets.items():
+            entries = merged.setdefault(key, {})
+            for command_id, value in bucket.items():
+                entries[command_id] = entries.get(command_id, 0) + value
+        
+        cut = self.starts[position] if position < len(self.starts) else len(self.ids)
+        del self.keys[position:]
+        del self.starts[position:]
+        del self.ids[cut:]
+        del self.values[cut:]
+        for key in sorted(merged):
+            entries = merged[key]
+            self.keys.append(key)
+            self.starts.append(len(self.ids))
+            self.ids.extend(entries.keys())
+            self.values.extend(entries.values())
+    
+    def extend(self, keys, starts, ids, values):
+        # Raw column bytes for buckets that all follow the last one, starts already offset
+        # past the existing entries
+        self.keys.frombytes(keys)
+        self.starts.frombytes(starts)
+        self.ids.frombytes(ids)
+        self.values.frombytes(values)
+
+
+class SpaceSaving:
+    # Heavy hitters in fixed memory (Metwally et al.): at most `capacity` counters. A new item
+    # takes over the smallest counter, so each count over-estimates its item by at most
+    # errors[item], itself at most total / capacity.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.heap = []  # (count, item) entries, one per item, refreshed lazily when stale
+    
+    def add(self, item, count=1):
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+            return
+        import heapq
+        if len(counts) < self.capacity:
+            counts[item] = count
+            self.errors[item] = 0
+            heapq.heappush(self.heap, (count, item))
+            return
+        
+        heap = self.heap
+        while True:
+            minimum, victim = heap[0]
+            current = counts[victim]
+            if current == minimum:
+                break
+            heapq.heapreplace(heap, (current, victim))
+        heapq.heapreplace(heap, (minimum + count, item))
+        del counts[victim]
+        del self.errors[victim]
+        counts[item] = minimum + count
+        self.errors[item] = minimum
+    
+    def minimum(self):
+        # Upper bound on the count of any item that isn't tracked
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+    
+    def merge(self, other):
+        # Mergeable summaries (Agarwal et al.): an untracked item may have had up to the minimum
+        import heapq
+        own_minimum, other_minimum = self.minimum(), other.minimum()
+        counts = {}
+        errors = {}
+        for item in chain(self.counts, other.counts):
+            if item not in counts:
+                counts[item] = self.counts.get(item, own_minimum) + other.counts.get(item, other_minimum)
+                errors[item] = self.errors.get(item, own_minimum) + other.errors.get(item, other_minimum)
+        
+        kept = sorted(counts, key=counts.__getitem__, reverse=True)[:self.capacity]
+        self.counts = {item: counts[item] for item in kept}
+        self.errors = {item: errors[item] for item in kept}
+        self.heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self.heap)
+        return self
+    
+    def most_common(self, n=None):
+        return sorted(self.counts.items(), key=itemgetter(1), reverse=True)[:n]
+
+
+def hash_command(command):
+    # 64-bit hash that, unlike hash(), is the same in every process, so sketches can be merged
+    data = command.encode('utf-8', errors='surrogateescape')
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), 'little')
+
+
+class CountMinSketch:
+    # Point estimates in fixed memory: never below the true count, and above it by at most
+    # total * e / width with probability 1 - e^-depth
+    def __init__(self, width=COUNT_MIN_WIDTH, depth=COUNT_MIN_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.counters = array('Q', bytes(8 * width * depth))
+        self.total = 0
+    
+    def _cells(self, hashed):
+        # Row hashes derived from two halves of one 64-bit hash (Kirsch-Mitzenmacher)
+        first = hashed & 0xFFFFFFFF
+        step = (hashed >> 32) | 1
+        width = self.width
+        return [row * width + (first + row * step) % width for row in range(self.depth)]
+    
+    def add_hash(self, hashed, count=1):
+        counters = self.counters
+        for cell in self._cells(hashed):
+            counters[cell] += count
+        self.total += count
+    
+    def estimate(self, item):
+        return min(map(self.counters.__getitem__, self._cells(hash_command(item))))
+    
+    def error_bound(self):
+        import math
+        return int(self.total * math.e / self.width)
+    
+    def merge(self, other):
+        self.counters = array('Q', map(sum, zip(self.counters, other.counters)))
+        self.total += other.total
+        return self
+
+
+class HyperLogLog:
+    # Distinct count in 2^precision bytes (Flajolet et al.), with the linear-counting
+    # correction for small cardinalities; merging is a register-wise max
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+    
+    def add_hash(self, hashed):
+        bits = 64 - self.precision
+        index = hashed >> bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+    
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * m and empty:
+            import math
+            estimate = m * math.log(m / empty)
+        return round(estimate)
+
+
+class DistinctSample:
+    # K-minimum-values sample with counts: the commands with the `size` smallest hashes are a
+    # uniform sample of the distinct commands, and since a command is either in it from its
+    # first use or never, their counts are exact. Until it fills up it holds every command.
+    def __init__(self, size=DISTINCT_SAMPLE_SIZE):
+        self.size = size
+        self.counts = {}
+        self.heap = []  # negated hashes, so the largest kept hash is on top
+    
+    def add_hash(self, hashed):
+        counts = self.counts
+        if hashed in counts:
+            counts[hashed] += 1
+        elif len(counts) < self.size:
+            import heapq
+            counts[hashed] = 1
+            heapq.heappush(self.heap, -hashed)
+        elif hashed < -self.heap[0]:
+            import heapq
+            del counts[-heapq.heapreplace(self.heap, -hashed)]
+            counts[hashed] = 1
+    
+    def merge(self, other):
+        import heapq
+        counts = dict(self.counts)
+        for hashed, count in other.counts.items():
+            counts[hashed] = counts.get(hashed, 0) + count
+        if len(self.counts) == self.size or len(other.counts) == other.size:
+            # Only hashes below both thresholds are a complete sample of the union
+            threshold = min(max(sample.counts) for sample in (self, other) if len(sample.counts) == sample.size)
+            counts = {hashed: count for hashed, count in counts.items() if hashed <= threshold}
+        kept = sorted(counts)[:self.size]
+        self.counts = {hashed: counts[hashed] for hashed in kept}
+        self.heap = [-hashed for hashed in kept]
+        heapq.heapify(self.heap)
+        return self
+    
+    @property
+    def complete(self):
+        return len(self.counts) < self.size
+    
+    def single_use_fraction(self):
+        if not self.counts:
+            return 0.0
+        return sum(1 for count in self.counts.values() if count == 1) / len(self.counts)
+
+
+class CommandSketch:
+    # Fixed-memory command statistics for --approx. Space-Saving ranks the heavy hitters and
+    # the Count-Min sketch tightens their estimates; both only over-count, so a reported count
+    # is an upper bound and count - error a lower bound on the true one. HyperLogLog and the
+    # distinct sample estimate the diversity figures.
+    def __init__(self, capacity=APPROX_CAPACITY):
+        self.heavy_hitters = SpaceSaving(capacity)
+        self.frequencies = CountMinSketch()
+        self.distinct = HyperLogLog()
+        self.sample = DistinctSample()
+    
+    def add(self, command):
+        hashed = hash_command(command)
+        self.heavy_hitters.add(command)
+        self.frequencies.add_hash(hashed)
+        self.distinct.add_hash(hashed)
+        self.sample.add_hash(hashed)
+    
+    def merge(self, other):
+        self.heavy_hitters.merge(other.heavy_hitters)
+        self.frequencies.merge(other.frequencies)
+        self.distinct.merge(other.distinct)
+        self.sample.merge(other.sample)
+        return self
+    
+    def estimate(self, command):
+        estimate = self.frequencies.estimate(command)
+        tracked = self.heavy_hitters.counts.get(command)
+        return estimate if tracked is None else min(estimate, tracked)
+    
+    def error(self, command):
+        tracked = self.heavy_hitters.counts.get(command)
+        if tracked is None:
+            return self.frequencies.error_bound()
+        return self.estimate(command) - (tracked - self.heavy_hitters.errors[command])
+    
+    def most_common(self, n=None):
+        estimates = [(command, self.estimate(command)) for command in self.heavy_hitters.counts]
+        return sorted(estimates, key=itemgetter(1), reverse=True)[:n]
+    
+    @property
+    def exact_diversity(self):
+        return self.sample.complete
+    
+    def unique_commands(self):
+        # A sample that never filled up saw every distinct command
+        if self.sample.complete:
+            return len(self.sample.counts)
+        return max(self.distinct.estimate(), len(self.sample.counts))
+    
+    def single_use_commands(self):
+        if self.sample.complete:
+            return sum(1 for count in self.sample.counts.values() if count == 1)
+        return round(self.unique_commands() * self.sample.single_use_fraction())
+
 
 def detect_current_shell():
     # Check SHELL environment variable first
@@ -17,17 +522,15 @@ def detect_current_shell():
         elif 'bash' in shell_name:
             return 'bash'
     
-    # Fallback: check parent process
+    # Fallback: check parent process (Linux)
     try:
-        import psutil
-        parent = psutil.Process().parent()
-        if parent:
-            parent_name = parent.name().lower()
-            if 'zsh' in parent_name:
-                return 'zsh'
-            elif 'bash' in parent_name:
-                return 'bash'
-    except ImportError:
+        with open(f"/proc/{os.getppid()}/comm") as f:
+            parent_name = f.read().strip().lower()
+        if 'zsh' in parent_name:
+            return 'zsh'
+        elif 'bash' in parent_name:
+            return 'bash'
+    except OSError:
         pass
     
     return None
@@ -79,20 +582,37 @@ def find_history_files():
     
     return history_files
 
+def find_fleet_histories(root):
+    # Every readable history file in the home directories under root, as (user, path) pairs
+    histories = []
+    try:
+        users = sorted(os.listdir(root))
+    except OSError as e:
+        print(f"Error reading {root}: {e}", file=sys.stderr)
+        return histories
+    
+    for user in users:
+        for name in FLEET_HISTORY_FILES:
+            path = os.path.join(root, user, name)
+            if os.path.isfile(path) and os.access(path, os.R_OK):
+                histories.append((user, path))
+    return histories
+
 def detect_shell_type(history_file):
     # Detect shell type based on history file format
     if not os.path.exists(history_file):
         return None
     
     try:
-        with open(history_file, 'r', encoding='utf-8', errors='ignore') as f:
+        with open_history_file(history_file) as f:
             lines = []
             for i, line in enumerate(f):
-                lines.append(line.strip())
+                lines.append(line.decode('utf-8', errors='ignore').strip())
                 if i >= 10:
                     break
         
         # Check for zsh format (: timestamp:duration;command)
+        import re
         zsh_pattern = re.compile(r'^: \d{10}:\d+;')
         if any(zsh_pattern.match(line) for line in lines):
             return 'zsh'
@@ -106,107 +626,227 @@ def detect_shell_type(history_file):
     except Exception:
         return None
 
-def parse_zsh_history(history_file, full_command=False, date_filter=None, command_filter=None):
-    history = []
+_zsh_header = None  # compiled on first use, so runs answered from the cache never import re
+
+def zsh_header():
+    global _zsh_header
+    if _zsh_header is None:
+        import re
+        _zsh_header = re.compile(rb': (\d{1,18}):(\d+);')
+    return _zsh_header
+
+def get_compression(history_file):
+    # Sniff the magic bytes; only regular files, so reading a pipe never loses data
+    if not os.path.isfile(history_file):
+        return None
+    with open(history_file, 'rb') as f:
+        magic = f.read(6)
+    for prefix, module in COMPRESSION_MAGIC:
+        if magic.startswith(prefix):
+            return module
+    return None
+
+def open_history_file(history_file, compression=None):
+    # Compressed archives are decompressed as a stream through a large read buffer
+    if compression is None:
+        compression = get_compression(history_file)
+    if compression is None:
+        return open(history_file, 'rb')
+    import importlib
+    import io
+    return io.BufferedReader(importlib.import_module(compression).open(history_file, 'rb'), READ_BUFFER_SIZE)
+
+def skip_bytes(f, count):
+    # Reads past the first count bytes; False when the stream ends first
+    while count > 0:
+        skipped = len(f.read(min(count, READ_BUFFER_SIZE)))
+        if not skipped:
+            return False
+        count -= skipped
+    return True
+
+def iter_history_lines(history_file, start_offset=0):
+    # Scan the raw bytes of a memory-mapped file; files that can't be mapped are read buffered
+    compression = get_compression(history_file)
+    if compression is not None:
+        # Offsets into an archive count decompressed bytes, which can only be skipped by reading
+        with open_history_file(history_file, compression) as f:
+            if skip_bytes(f, start_offset):
+                yield from f
+        return
+    
+    import mmap
+    with open(history_file, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files, pipes and other streams; pipes can't seek, so they skip by reading
+            if skip_bytes(f, start_offset):
+                yield from f
+            return
+        with mapped:
+            mapped.seek(start_offset)
+            yield from iter(mapped.readline, b'')
+
+def parse_zsh_record(line):
+    # Extended history record: b": <timestamp>:<duration>;<command>", command left undecoded
+    match = (_zsh_header or zsh_header()).match(line)
+    if not match:
+        return None
+    timestamp, duration = map(int, match.groups())
+    if timestamp > MAX_TIMESTAMP:
+        # Corrupted; datetime can't place it on any day
+        return None
+    return timestamp, duration if duration <= 0xFFFFFFFF else 0xFFFFFFFF, line[match.end():].strip()
+
+def decode_command(raw_cmd, full_command=False):
+    # Decode only the part of the raw command bytes that is actually reported
+    if full_command:
+        return raw_cmd.decode('utf-8', errors='ignore').strip()
+    parts = raw_cmd.split(None, 1)
+    if not parts:
+        return ""
+    first_word = parts[0]
+    if not first_word.endswith(b"'"):
+        try:
+            return first_word.decode('ascii')
+        except UnicodeDecodeError:
+            pass
+    return extract_command(raw_cmd.decode('utf-8', errors='ignore'), full_command)
+
+def parse_zsh_history(history_file, full_command=False, date_filter=None, command_filter=None,
+                      start_offset=0, checkpoint=None, end_offset=None):
+    count = 0
+    lines = malformed = dropped_by_date = dropped_by_command = 0
     
     try:
-        with open(history_file, 'r', encoding='utf-8', errors='ignore') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
+        offset = start_offset
+        raw_line = b''
+        for raw_line in iter_history_lines(history_file, start_offset):
+            if end_offset is not None and offset >= end_offset:
+                break
+            # Everything before this line has been consumed
+            if checkpoint is not None:
+                checkpoint['offset'] = offset
+                checkpoint['records'] = count
+            offset += len(raw_line)
+            lines += 1
+            
+            record = parse_zsh_record(raw_line.strip())
+            if record is None:
+                # Continuation lines of multiline commands as well as corrupted ones
+                malformed += 1
+                continue
+            timestamp, duration, full_cmd = record
+            
+            # Early date filtering
+            if date_filter:
+                start_time, end_time = date_filter
+                if start_time and timestamp < start_time:
+                    dropped_by_date += 1
                     continue
-                    
-                # Extract timestamp
-                date_match = re.search(r': (\d{10}):', line)
-                if not date_match:
+                if end_time and timestamp > end_time:
+                    dropped_by_date += 1
                     continue
                 
-                timestamp = int(date_match.group(1))
+            if not full_cmd:
+                continue
+                
+            command = decode_command(full_cmd, full_command)
+            if command:
+                # Early command filtering
+                if command_filter:
+                    if not (command.startswith(command_filter + " ") or command == command_filter):
+                        dropped_by_command += 1
+                        continue
+                
+                yield command, timestamp, duration
+                count += 1
+        
+        # Only a fully written last line is safe to resume after
+        if checkpoint is not None and raw_line.endswith(b'\n'):
+            checkpoint['offset'] = offset
+            checkpoint['records'] = count
+        
+        if _profiler is not None:
+            _profiler.counters.update({'lines read': lines, 'unparsed lines': malformed,
+                                       'dropped by date filter': dropped_by_date,
+                                       'dropped by command filter': dropped_by_command})
+                
+    except Exception as e:
+        print(f"Error reading zsh history file: {e}", file=sys.stderr)
+        if checkpoint is not None:
+            checkpoint['offset'] = start_offset
+            checkpoint['records'] = 0
+
+def parse_bash_history(history_file, full_command=False, date_filter=None, command_filter=None,
+                       start_offset=0, checkpoint=None, end_offset=None, undated=None):
+    # Commands without a "#timestamp" line get `undated`, the current time by default
+    count = 0
+    lines = dropped_by_date = dropped_by_command = 0
+    
+    try:
+        offset = start_offset
+        current_timestamp = None
+        now = int(time.time()) if undated is None else undated
+        
+        for raw_line in iter_history_lines(history_file, start_offset):
+            if end_offset is not None and offset >= end_offset:
+                break
+            offset += len(raw_line)
+            lines += 1
+            line = raw_line.strip()
+            
+            # Check if this line is a timestamp
+            if line.startswith(b'#') and len(line) > 1 and line[1:].isdigit():
+                # One datetime can't handle leaves the command undated
+                current_timestamp = int(line[1:]) if len(line) <= 13 else None
+                if current_timestamp is not None and current_timestamp > MAX_TIMESTAMP:
+                    current_timestamp = None
+                continue
+            
+            if line:
+                timestamp = current_timestamp if current_timestamp else now
                 
                 # Early date filtering
                 if date_filter:
                     start_time, end_time = date_filter
                     if start_time and timestamp < start_time:
+                        current_timestamp = None
+                        dropped_by_date += 1
                         continue
                     if end_time and timestamp > end_time:
+                        current_timestamp = None
+                        dropped_by_date += 1
                         continue
-                    
-                # Extract command - format: ": timestamp:duration;command"
-                if ';' in line:
-                    timestamp_end = line.find(':0;')
-                    if timestamp_end != -1:
-                        full_cmd = line[timestamp_end + 3:].strip()
-                    else:
-                        duration_match = re.search(r': \d{10}:\d+;', line)
-                        if duration_match:
-                            full_cmd = line[duration_match.end():].strip()
-                        else:
-                            continue
-                else:
-                    continue
-                    
-                if not full_cmd:
-                    continue
-                    
-                command = extract_command(full_cmd, full_command)
+                
+                command = decode_command(line, full_command)
                 if command:
                     # Early command filtering
                     if command_filter:
                         if not (command.startswith(command_filter + " ") or command == command_filter):
-                            continue
-                    
-                    history.append((command, timestamp))
-                
-    except Exception as e:
-        print(f"Error reading zsh history file: {e}")
-        return []
-    
-    return history
-
-def parse_bash_history(history_file, full_command=False, date_filter=None, command_filter=None):
-    history = []
-    
-    try:
-        with open(history_file, 'r', encoding='utf-8', errors='ignore') as f:
-            current_timestamp = None
-            
-            for line in f:
-                line = line.strip()
-                
-                # Check if this line is a timestamp
-                if line.startswith('#') and len(line) > 1 and line[1:].isdigit():
-                    current_timestamp = int(line[1:])
-                    continue
-                
-                if line:
-                    timestamp = current_timestamp if current_timestamp else int(datetime.datetime.now().timestamp())
-                    
-                    # Early date filtering
-                    if date_filter:
-                        start_time, end_time = date_filter
-                        if start_time and timestamp < start_time:
-                            current_timestamp = None
-                            continue
-                        if end_time and timestamp > end_time:
                             current_timestamp = None
+                            dropped_by_command += 1
                             continue
                     
-                    command = extract_command(line, full_command)
-                    if command:
-                        # Early command filtering
-                        if command_filter:
-                            if not (command.startswith(command_filter + " ") or command == command_filter):
-                                current_timestamp = None
-                                continue
-                        
-                        history.append((command, timestamp))
-                        current_timestamp = None
+                    yield command, timestamp, 0
+                    count += 1
+                    current_timestamp = None
+            
+            # A pending "#timestamp" line belongs to a command not yet written
+            if checkpoint is not None and raw_line.endswith(b'\n') and current_timestamp is None:
+                checkpoint['offset'] = offset
+                checkpoint['records'] = count
+        
+        if _profiler is not None:
+            _profiler.counters.update({'lines read': lines, 'dropped by date filter': dropped_by_date,
+                                       'dropped by command filter': dropped_by_command})
             
     except Exception as e:
-        print(f"Error reading bash history file: {e}")
-        return []
-    
-    return history
+        print(f"Error reading bash history file: {e}", file=sys.stderr)
+        if checkpoint is not None:
+            checkpoint['offset'] = start_offset
+            checkpoint['records'] = 0
 
 def extract_command(full_cmd, full_command=False):
     if not full_cmd:
@@ -220,6 +860,7 @@ def extract_command(full_cmd, full_command=False):
             first_word = command_parts[0]
             # Handle malformed entries
             if first_word.endswith("'") and (first_word.isdigit() or first_word in ["35'", "00;35'"]):
+                profile_count('malformed commands')
                 if full_cmd.startswith("export"):
                     return "export"
                 else:
@@ -231,62 +872,763 @@ def extract_command(full_cmd, full_command=False):
                 return first_word
         return ""
 
-def parse_history(history_file, full_command=False, shell_type=None, date_filter=None, command_filter=None):
-    if shell_type is None:
-        shell_type = detect_shell_type(history_file)
+def get_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, 'freq')
+
+def get_cache_path(history_file, shell_type, full_command):
+    key = f"{os.path.realpath(history_file)}|{shell_type}|{int(full_command)}"
+    return os.path.join(get_cache_dir(), blake2b(key.encode('utf-8'), digest_size=20).hexdigest() + '.cache')
+
+def open_cache_file(cache_path):
+    f = open(cache_path, 'rb')
+    # Unpickling runs code, so only files this user wrote are trusted
+    if os.fstat(f.fileno()).st_uid != os.getuid():
+        f.close()
+        raise PermissionError(f"{cache_path} is owned by another user")
+    return f
+
+def cache_unpickler(f):
+    try:
+        # The C unpickler alone; the pickle module around it imports re, which costs more
+        from _pickle import Unpickler, UnpicklingError
+    except ImportError:
+        from pickle import Unpickler, UnpicklingError
+    
+    class CacheUnpickler(Unpickler):
+        # Only what a cache holds, with freq's classes taken from this module whichever one
+        # pickled them: __main__ when run as a script, freq when imported
+        def find_class(self, module, name):
+            if module == 'array' and name in ('array', '_array_reconstructor'):
+                return super().find_class(module, name)
+            if name in ('HistoryStore', 'RollupTable'):
+                return globals()[name]
+            raise UnpicklingError(f"{module}.{name} is not expected in a cache")
+    
+    return CacheUnpickler(f)
+
+def load_cache(cache_path):
+    if _cache_memo is not None:
+        # Another freq process may have rewritten the file since it was memoized
+        try:
+            mtime = os.stat(cache_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        memo = _cache_memo.get(cache_path)
+        if memo is not None and memo[0] == mtime:
+            return memo[1]
+    
+    try:
+        with open_cache_file(cache_path) as f:
+            cache = cache_unpickler(f).load()
+        if isinstance(cache, dict) and cache.get('version') == CACHE_VERSION:
+            if _cache_memo is not None:
+                _cache_memo[cache_path] = (os.fstat(f.fileno()).st_mtime_ns, cache)
+            return cache
+    except Exception:
+        pass
+    return None
+
+def discard_cache(cache_path):
+    # Cached objects are updated in place, so a memoized one that couldn't be saved is stale
+    if _cache_memo is not None:
+        _cache_memo.pop(cache_path, None)
+
+def make_cache_dir(cache_dir):
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    if stat.S_IMODE(os.stat(cache_dir).st_mode) != 0o700:
+        os.chmod(cache_dir, 0o700)
+
+def save_cache(cache_path, cache):
+    # Caches can hold whole command lines copied out of a private history file
+    import pickle
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        make_cache_dir(os.path.dirname(cache_path))
+        with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        if _cache_memo is not None:
+            _cache_memo[cache_path] = (os.stat(cache_path).st_mtime_ns, cache)
+    except Exception:
+        discard_cache(cache_path)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def read_fingerprint(history_file, offset):
+    # Bytes just before the resume point, used to detect in-place rewrites
+    start = max(0, offset - 64)
+    with open(history_file, 'rb') as f:
+        f.seek(start)
+        return f.read(offset - start)
+
+def get_index_path(cache_path):
+    return os.path.splitext(cache_path)[0] + '.index'
+
+def is_cache_current(cache, file_stat, history_file):
+    # Same file, and the bytes the cache stopped at are still in place
+    if not cache or cache['inode'] != file_stat.st_ino or cache['device'] != file_stat.st_dev:
+        return False
+    if cache['size'] == file_stat.st_size:
+        # Appending always grows the file, so a new mtime at the same size is a rewrite
+        return cache['mtime'] == file_stat.st_mtime_ns
+    # Archives are only reused unchanged; their offsets are into the decompressed stream
+    if cache.get('compressed') or cache['offset'] > file_stat.st_size:
+        return False
+    try:
+        return read_fingerprint(history_file, cache['offset']) == cache['fingerprint']
+    except OSError:
+        return False
+
+def update_time_index(index, history, first_new_record, block_offsets):
+    # Blocks of INDEX_BLOCK_RECORDS records, each with its resume offset and timestamp bounds
+    offsets = index['offsets']
+    for offset in block_offsets:
+        if len(offsets) * INDEX_BLOCK_RECORDS < len(history):
+            offsets.append(offset)
+    
+    # The last block may have been partial, so recompute bounds from there on
+    first_block = first_new_record // INDEX_BLOCK_RECORDS
+    del index['mins'][first_block:]
+    del index['maxs'][first_block:]
+    timestamps = history.timestamps
+    for start in range(first_block * INDEX_BLOCK_RECORDS, len(history), INDEX_BLOCK_RECORDS):
+        block = timestamps[start:start + INDEX_BLOCK_RECORDS]
+        index['mins'].append(min(block))
+        # Undated commands are dated when read, so a block holding one can match any range
+        index['maxs'].append(max(block) if index['mins'][-1] != NO_TIMESTAMP else sys.maxsize)
+
+def get_rollup_path(cache_path):
+    return os.path.splitext(cache_path)[0] + '.rollup'
+
+def get_time_zone():
+    # Day tables are keyed by local date, so they only hold for the zone they were built in
+    return time.timezone, time.altzone, time.daylight, time.tzname
+
+def new_rollup():
+    return {
+        'version': CACHE_VERSION,
+        'zone': get_time_zone(),
+        'ordered': True,
+        'last': None,
+        'counts': array('Q'),
+        'seconds': array('Q'),
+        'firsts': array('q'),
+        'lasts': array('q'),
+        'undated': array('Q'),
+        'order': array('I'),  # command IDs by first record, and by first record with a duration
+        'timed': array('I'),
+        'hour_counts': RollupTable(),
+        'hour_seconds': RollupTable(),
+        'day_counts': RollupTable(),
+        'day_seconds': RollupTable(),
+    }
+
+def update_rollup(rollup, history, first_new_record, stop=None):
+    # Fold records from first_new_record on into the per-command totals and the per-hour and
+    # per-local-day tables; hours are epoch hours, days are keyed by date ordinal
+    if stop is None:
+        stop = len(history)
+    if ((stop - first_new_record >= NUMPY_MIN_RECORDS or os.environ.get('FREQ_BACKEND') == 'numpy')
+            and isinstance(history, HistoryStore) and load_numpy() is not None):
+        return update_rollup_numpy(rollup, history, first_new_record, stop)
+    counts, seconds = rollup['counts'], rollup['seconds']
+    firsts, lasts = rollup['firsts'], rollup['lasts']
+    order, timed = rollup['order'], rollup['timed']
+    undated = rollup['undated']
+    new_commands = len(history.commands) - len(counts)
+    if new_commands > 0:
+        counts.frombytes(bytes(8 * new_commands))
+        seconds.frombytes(bytes(8 * new_commands))
+        undated.frombytes(bytes(8 * new_commands))
+        firsts.extend([sys.maxsize] * new_commands)
+        lasts.extend([-sys.maxsize] * new_commands)
+    
+    hour_counts, hour_seconds, day_counts, day_seconds = {}, {}, {}, {}
+    hour = day = None
+    bucket_start = bucket_end = day_start = day_end = 0
+    ordered = rollup['ordered']
+    last = rollup['last'] if rollup['last'] is not None else -sys.maxsize
+    records = zip(history.ids[first_new_record:stop], history.timestamps[first_new_record:stop],
+                  history.durations[first_new_record:stop])
+    for command_id, timestamp, duration in records:
+        if not counts[command_id]:
+            order.append(command_id)
+        counts[command_id] += 1
+        if duration:
+            if not seconds[command_id]:
+                timed.append(command_id)
+            seconds[command_id] += duration
+        if timestamp == NO_TIMESTAMP:
+            # Dated only when read, so kept out of the time tables
+            undated[command_id] += 1
+            continue
+        
+        # The window where both the current hour and the current local day hold
+        if not bucket_start <= timestamp < bucket_end:
+            if not day_start <= timestamp < day_end:
+                date, day_start, day_end = local_day_bounds(timestamp)
+                day = date.toordinal()
+            hour = timestamp // 3600
+            bucket_start = max(hour * 3600, day_start)
+            bucket_end = min(hour * 3600 + 3600, day_end)
+            hour_bucket = hour_counts.setdefault(hour, {})
+            day_bucket = day_counts.setdefault(day, {})
+        hour_bucket[command_id] = hour_bucket.get(command_id, 0) + 1
+        day_bucket[command_id] = day_bucket.get(command_id, 0) + 1
+        if duration:
+            bucket = hour_seconds.setdefault(hour, {})
+            bucket[command_id] = bucket.get(command_id, 0) + duration
+            bucket = day_seconds.setdefault(day, {})
+            bucket[command_id] = bucket.get(command_id, 0) + duration
+        if timestamp < firsts[command_id]:
+            firsts[command_id] = timestamp
+        if timestamp > lasts[command_id]:
+            lasts[command_id] = timestamp
+        if timestamp < last:
+            ordered = False
+        last = timestamp
+    
+    rollup['hour_counts'].merge(hour_counts)
+    rollup['hour_seconds'].merge(hour_seconds)
+    rollup['day_counts'].merge(day_counts)
+    rollup['day_seconds'].merge(day_seconds)
+    rollup['ordered'] = ordered
+    rollup['last'] = None if last == -sys.maxsize else last
+
+def load_rollup(cache_path, cache):
+    # The rollup of the cached records. One built from a prefix of them is caught up in memory,
+    # and only saved again once that has fallen well behind; one from another lineage of the
+    # cache or another time zone is rebuilt.
+    if 'lineage' not in cache:
+        # The cache couldn't be saved, so neither could a rollup
+        return None
+    rollup_path = get_rollup_path(cache_path)
+    rollup = load_cache(rollup_path)
+    history = cache['history']
+    rebuilt = (not rollup or rollup['lineage'] != cache['lineage'] or rollup['zone'] != get_time_zone()
+               or rollup['records'] > len(history))
+    if rebuilt:
+        rollup = new_rollup()
+        rollup.update(lineage=cache['lineage'], records=0)
+    
+    lag = len(history) - rollup['records']
+    if lag:
+        update_rollup(rollup, history, rollup['records'])
+        rollup['records'] = len(history)
+        if rebuilt or lag > ROLLUP_LAG_RECORDS:
+            save_cache(rollup_path, rollup)
+    return rollup
+
+def get_delta_path(cache_path):
+    return os.path.splitext(cache_path)[0] + '.delta'
+
+def load_history_cache(cache_path):
+    # The cache as last written whole, plus the appends recorded in its delta file since: each
+    # a length-prefixed pickle of the records it adds and the file state after them. Appends
+    # already applied, as in a cache the daemon keeps in memory, are skipped by offset.
+    cache = load_cache(cache_path)
+    if not cache:
+        return None
+    import io
+    history = cache['history']
+    try:
+        with open_cache_file(get_delta_path(cache_path)) as f:
+            f.seek(cache['delta_offset'])
+            while True:
+                header = f.read(8)
+                if not header:
+                    break
+                data = f.read(int.from_bytes(header, 'little'))
+                if len(header) < 8 or len(data) < int.from_bytes(header, 'little'):
+                    raise EOFError("partially written append")
+                segment = cache_unpickler(io.BytesIO(data)).load()
+                if segment['lineage'] != cache['lineage'] or segment['records'] > len(history):
+                    raise ValueError("append to another version of the cache")
+                if segment['records'] + len(segment['tail']) > len(history):
+                    if segment['records'] != len(history):
+                        raise ValueError("overlapping appends")
+                    history.extend(segment['tail'])
+                    cache['undated'] += segment['undated']
+                    cache.update((key, segment[key]) for key in CACHE_STATE)
+                cache['delta_offset'] = f.tell()
+                cache['delta_records'] += len(segment['tail'])
+                cache['delta_segments'] += 1
+    except FileNotFoundError:
+        pass
+    except Exception:
+        # The cache holds everything up to here; the next change rewrites it whole
+        cache['delta_broken'] = True
+    return cache
+
+def append_history_cache(cache_path, cache, segment):
+    # Records an append to the cache without rewriting it, or rewrites it whole, folding in
+    # the delta file, once that has grown long or can't be trusted
+    import pickle
+    delta_path = get_delta_path(cache_path)
+    if (cache['delta_segments'] + 1 >= DELTA_SEGMENTS or cache['delta_records'] + len(segment['tail']) >= DELTA_RECORDS
+            or cache.get('delta_broken')):
+        cache.pop('delta_broken', None)
+        cache.update(delta_offset=0, delta_records=0, delta_segments=0)
+        save_cache(cache_path, cache)
+        try:
+            os.remove(delta_path)
+        except OSError:
+            pass
+        return
     
+    data = pickle.dumps(segment, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        make_cache_dir(os.path.dirname(delta_path))
+        with os.fdopen(os.open(delta_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600), 'wb') as f:
+            f.write(len(data).to_bytes(8, 'little') + data)
+            cache['delta_offset'] = f.tell()
+        cache['delta_records'] += len(segment['tail'])
+        cache['delta_segments'] += 1
+    except OSError:
+        discard_cache(cache_path)
+
+def update_history_cache(history_file, parser, shell_type, full_command=False):
+    # Brings the parse cache up to date with the file. Returns the cache, holding the cached
+    # records and the file state they were read from, and a store of any records from a
+    # partially written last line, which are never cached; None for files that can't be cached.
+    try:
+        file_stat = os.stat(history_file)
+    except OSError:
+        return None
+    if not stat.S_ISREG(file_stat.st_mode):
+        return None
+    
+    compressed = get_compression(history_file) is not None
+    cache_path = get_cache_path(history_file, shell_type, full_command)
+    index_path = get_index_path(cache_path)
+    cache = load_history_cache(cache_path)
+    if not is_cache_current(cache, file_stat, history_file):
+        cache = None
+    
+    index = None
+    if cache:
+        if compressed or (cache['offset'] == file_stat.st_size and cache['mtime'] == file_stat.st_mtime_ns):
+            return cache, HistoryStore()
+        index = load_cache(index_path)
+        if not index or index['offset'] != cache['offset'] or index['records'] != len(cache['history']):
+            cache = None
+    
+    if cache:
+        history = cache['history']
+        start_offset = cache['offset']
+        undated = cache['undated']
+    else:
+        history = HistoryStore()
+        start_offset = 0
+        undated = 0
+        index = {'version': CACHE_VERSION, 'offsets': [], 'mins': [], 'maxs': []}
+    
+    # Parse only the appended tail, or everything after truncation/rotation. Commands without
+    # a timestamp are cached undated rather than with the time they happened to be parsed.
+    checkpoint = {'offset': start_offset, 'records': 0}
+    options = {'undated': NO_TIMESTAMP} if parser is parse_bash_history else {}
+    first_new_record = len(history)
+    next_block = -(-first_new_record // INDEX_BLOCK_RECORDS) * INDEX_BLOCK_RECORDS
+    block_offsets = []
+    tail = HistoryStore()
+    for command, timestamp, duration in parser(history_file, full_command, start_offset=start_offset,
+                                               checkpoint=checkpoint, **options):
+        if first_new_record + len(tail) == next_block:
+            # The checkpoint is a safe place to resume parsing at this record
+            block_offsets.append(checkpoint['offset'])
+            next_block += INDEX_BLOCK_RECORDS
+        tail.append(command, timestamp, duration)
+    if compressed:
+        # An archive is complete as written, so an unterminated last line is still a record
+        checkpoint['records'] = len(tail)
+    appended = tail[:checkpoint['records']]
+    history.extend(appended)
+    undated += appended.timestamps.count(NO_TIMESTAMP)
+    
+    saved = None
+    if start_offset == 0 or checkpoint['offset'] != start_offset:
+        try:
+            fingerprint = b'' if compressed else read_fingerprint(history_file, checkpoint['offset'])
+        except OSError:
+            fingerprint = None
+        if fingerprint is not None:
+            file_state = {
+                'version': CACHE_VERSION,
+                'path': os.path.realpath(history_file),
+                'inode': file_stat.st_ino,
+                'device': file_stat.st_dev,
+                'size': file_stat.st_size,
+                'mtime': file_stat.st_mtime_ns,
+                'offset': checkpoint['offset'],
+                'fingerprint': fingerprint,
+                'compressed': compressed,
+            }
+            update_time_index(index, history, first_new_record, block_offsets)
+            index.update(file_state, records=len(history))
+            save_cache(index_path, index)
+            if cache:
+                # Appended to: the records are added to the delta file
+                segment = dict(file_state, lineage=cache['lineage'], records=first_new_record, tail=appended,
+                               undated=undated - cache['undated'])
+                cache.update(file_state, undated=undated)
+                append_history_cache(cache_path, cache, segment)
+                saved = cache
+            else:
+                # A new lineage: rollups and appends made for the records cached before no longer apply
+                saved = dict(file_state, history=history, undated=undated, lineage=os.urandom(8).hex(),
+                             delta_offset=0, delta_records=0, delta_segments=0)
+                save_cache(cache_path, saved)
+                try:
+                    os.remove(get_delta_path(cache_path))
+                except OSError:
+                    pass
+        else:
+            discard_cache(index_path)
+            discard_cache(cache_path)
+    elif cache:
+        saved = cache
+    
+    return saved or {'history': history, 'undated': undated}, tail[checkpoint['records']:]
+
+def cached_history(cache, pending):
+    # The cached records followed by those from a partially written last line, with commands
+    # that have no timestamp of their own dated now
+    history = cache['history']
+    if len(pending):
+        history = history.copy()
+        history.extend(pending)
+    if cache['undated'] or NO_TIMESTAMP in pending.timestamps:
+        now = int(time.time())
+        timestamps = array('q', [now if timestamp == NO_TIMESTAMP else timestamp for timestamp in history.timestamps])
+        history = history._derive(history.ids, timestamps, history.durations)
+    return history
+
+def parse_history_cached(history_file, parser, shell_type, full_command=False):
+    result = update_history_cache(history_file, parser, shell_type, full_command)
+    if result is None:
+        return None
+    return cached_history(*result)
+
+def find_index_blocks(index, date_filter):
+    # Skip leading blocks that end before the range and trailing blocks that start after it
+    start_time, end_time = date_filter
+    mins, maxs = index['mins'], index['maxs']
+    first = 0
+    if start_time:
+        while first < len(maxs) and maxs[first] < start_time:
+            first += 1
+    stop = len(mins)
+    if end_time:
+        while stop > first and mins[stop - 1] > end_time:
+            stop -= 1
+    return first, stop
+
+def parse_history_range(history_file, parser, shell_type, full_command, date_filter, command_filter):
+    # Use the sidecar time index to parse only the byte ranges that can hold the date range
+    try:
+        file_stat = os.stat(history_file)
+    except OSError:
+        return None
+    if not stat.S_ISREG(file_stat.st_mode):
+        return None
+    
+    index = load_cache(get_index_path(get_cache_path(history_file, shell_type, full_command)))
+    if not is_cache_current(index, file_stat, history_file):
+        return None
+    if index.get('compressed'):
+        # Seeking into an archive means decompressing up to the offset; the cached store is cheaper
+        return None
+    
+    offsets = index['offsets']
+    first, stop = find_index_blocks(index, date_filter)
+    ranges = []
+    if stop == len(offsets):
+        ranges.append((offsets[first] if first < stop else index['offset'], None))
+    else:
+        if first < stop:
+            ranges.append((offsets[first], offsets[stop]))
+        # Records appended since the index was built can have any timestamp
+        ranges.append((index['offset'], None))
+    
+    return chain.from_iterable(parser(history_file, full_command, date_filter, command_filter,
+                                      start_offset=start, end_offset=end) for start, end in ranges)
+
+def filter_by_date(history, date_filter):
+    if not date_filter:
+        return history
+    start_time, end_time = date_filter
+    if isinstance(history, HistoryStore):
+        return history.select_time_range(start_time, end_time)
+    return (record for record in history
+            if not (start_time and record[1] < start_time) and not (end_time and record[1] > end_time))
+
+def command_matcher(command_filter):
+    prefix = command_filter + " "
+    return lambda command: command.startswith(prefix) or command == command_filter
+
+def filter_by_command(history, command_filter):
+    if not command_filter:
+        return history
+    matches = command_matcher(command_filter)
+    if isinstance(history, HistoryStore):
+        return history.select_commands(matches)
+    return (record for record in history if matches(record[0]))
+
+def get_history_parser(shell_type):
     if shell_type == 'zsh':
-        return parse_zsh_history(history_file, full_command, date_filter, command_filter)
+        return parse_zsh_history
     elif shell_type in ['bash', 'bash_timestamped']:
-        return parse_bash_history(history_file, full_command, date_filter, command_filter)
+        return parse_bash_history
+    return None
+
+def parse_history(history_file, full_command=False, shell_type=None, date_filter=None, command_filter=None,
+                  use_cache=True):
+    # Returns a HistoryStore when served from the cache, otherwise a lazy stream of records
+    if shell_type is None:
+        shell_type = detect_shell_type(history_file)
+    
+    parser = get_history_parser(shell_type)
+    if parser is None:
+        print(f"Unknown shell type: {shell_type}", file=sys.stderr)
+        return HistoryStore()
+    
+    if use_cache:
+        if date_filter:
+            history = parse_history_range(history_file, parser, shell_type, full_command, date_filter, command_filter)
+            if history is not None:
+                return history
+        history = parse_history_cached(history_file, parser, shell_type, full_command)
+        if history is not None:
+            if date_filter:
+                records = len(history)
+                with ProfileStage('date filter'):
+                    history = filter_by_date(history, date_filter)
+                profile_count('dropped by date filter', records - len(history))
+            if command_filter:
+                records = len(history)
+                with ProfileStage('command filter'):
+                    history = filter_by_command(history, command_filter)
+                profile_count('dropped by command filter', records - len(history))
+            return history
+    
+    return parser(history_file, full_command, date_filter, command_filter)
+
+def parse_histories(history_files, full_command=False, shell_types=None, date_filter=None, command_filter=None,
+                    use_cache=True):
+    # Several files are merged lazily by timestamp, holding one pending record per file
+    if shell_types is None:
+        shell_types = [None] * len(history_files)
+    histories = [parse_history(history_file, full_command, shell_type, date_filter, command_filter, use_cache)
+                 for history_file, shell_type in zip(history_files, shell_types)]
+    if len(histories) == 1:
+        return histories[0]
+    import heapq
+    return heapq.merge(*histories, key=itemgetter(1))
+
+def expand_history_files(patterns):
+    import glob
+    # Globs are expanded here too, so quoted patterns work; a pattern matching nothing is kept as-is
+    history_files = []
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        for history_file in sorted(glob.glob(pattern)) or [pattern]:
+            if history_file not in history_files:
+                history_files.append(history_file)
+    return history_files
+
+def find_record_boundary(f, offset, shell_type):
+    # First record start at or after offset: a zsh ": <ts>:<dur>;" header or a bash "#<ts>" line
+    if offset == 0:
+        return 0
+    import re
+    bash_record_start = re.compile(rb'#\d+\s*$')
+    f.seek(offset - 1)
+    f.readline()
+    while True:
+        position = f.tell()
+        line = f.readline()
+        if not line:
+            return position
+        if shell_type == 'zsh':
+            if zsh_header().match(line):
+                return position
+        elif shell_type == 'bash_timestamped':
+            if bash_record_start.match(line):
+                return position
+        else:
+            return position
+
+def split_history_file(history_file, shell_type, chunks, min_chunk_size=1 << 20):
+    size = os.path.getsize(history_file)
+    chunks = max(1, min(chunks, size // min_chunk_size))
+    with open(history_file, 'rb') as f:
+        boundaries = [find_record_boundary(f, size * i // chunks, shell_type) for i in range(chunks)]
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+def aggregate_history_chunk(history_file, parser, start_offset, end_offset, options):
+    record_counts = Counter()
+    alias_counts = Counter()
+    history = parser(history_file, options['full_command'], options['date_filter'], options['command_filter'],
+                     start_offset=start_offset, end_offset=end_offset)
+    stats = run_pipeline(history, options, record_counts, alias_counts)
+    return stats, record_counts, alias_counts
+
+def profile_history_chunk(history_file, parser, start_offset, end_offset, options):
+    # Worker side of a --profile run: the counters go back with the results, while the
+    # parent's stage around the pool covers the timings
+    global _profiler
+    _profiler = Profiler()
+    return aggregate_history_chunk(history_file, parser, start_offset, end_offset, options) + (_profiler.counters,)
+
+def aggregate_history_parallel(history_files, shell_types, options, jobs, record_counts, alias_counts,
+                               file_stats=None):
+    # Plain files are split into byte ranges; archives can't be, so each is decompressed by one worker.
+    # Passing file_stats also keeps a partial aggregate per file, in history_files order.
+    tasks = []
+    positions = []
+    for position, (history_file, shell_type) in enumerate(zip(history_files, shell_types)):
+        if shell_type is None:
+            shell_type = detect_shell_type(history_file)
+        parser = get_history_parser(shell_type)
+        if parser is None:
+            print(f"Unknown shell type: {shell_type}", file=sys.stderr)
+            continue
+        if get_compression(history_file) is not None:
+            ranges = [(0, None)]
+        else:
+            # $SHELL and -s only say bash; the file says whether its records start with "#<ts>"
+            # lines, which a chunk boundary mustn't separate from their command
+            boundary_type = shell_type
+            if shell_type == 'bash' and detect_shell_type(history_file) == 'bash_timestamped':
+                boundary_type = 'bash_timestamped'
+            ranges = split_history_file(history_file, boundary_type, jobs * 4)
+        tasks.extend((history_file, parser, start, end) for start, end in ranges)
+        positions.extend([position] * len(ranges))
+    
+    stats = HistoryStats()
+    if len(tasks) <= 1:
+        partials = [aggregate_history_chunk(*task, options) for task in tasks]
     else:
-        print(f"Unknown shell type: {shell_type}")
-        return []
+        from concurrent.futures import ProcessPoolExecutor
+        chunk = aggregate_history_chunk if _profiler is None else profile_history_chunk
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            partials = list(executor.map(chunk, *zip(*tasks), [options] * len(tasks)))
+    
+    if file_stats is not None:
+        file_stats[:] = [HistoryStats() for _ in history_files]
+    for position, partial in zip(positions, partials):
+        partial_stats, partial_record_counts, partial_alias_counts = partial[:3]
+        stats.merge(partial_stats)
+        if file_stats is not None:
+            file_stats[position].merge(partial_stats)
+        record_counts.update(partial_record_counts)
+        alias_counts.update(partial_alias_counts)
+        if len(partial) > 3:
+            _profiler.counters.update(partial[3])
+    return stats
+
+def get_file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def read_alias_file(file_path, definitions, alias_sources, mtimes):
+    # Follows source/. includes depth-first; mtimes doubles as the visited set, which stops cycles
+    real_path = os.path.realpath(file_path)
+    if real_path in mtimes:
+        return
+    mtimes[real_path] = get_file_mtime(real_path)
+    if mtimes[real_path] is None:
+        return
+    
+    import shlex
+    try:
+        with open(real_path, 'r', encoding='utf-8', errors='ignore') as f:
+            lines = f.readlines()
+    except OSError:
+        return
+    
+    for line in lines:
+        line = line.strip()
+        if line.startswith('alias '):
+            try:
+                alias_defs = shlex.split(line, comments=True)[1:]
+            except ValueError:
+                alias_defs = [line[6:]]
+            for alias_def in alias_defs:
+                if '=' in alias_def:
+                    alias_name, alias_cmd = alias_def.split('=', 1)
+                    alias_name = alias_name.strip()
+                    alias_cmd = alias_cmd.strip().strip('\'"')
+                    if alias_name and alias_cmd:
+                        definitions[alias_name] = alias_cmd
+                        alias_sources[alias_name] = os.path.basename(file_path)
+        
+        elif line.startswith(('source ', '. ')):
+            try:
+                words = shlex.split(line, comments=True)
+            except ValueError:
+                continue
+            if len(words) > 1:
+                include = os.path.expanduser(os.path.expandvars(words[1]))
+                read_alias_file(os.path.join(os.path.dirname(real_path), include),
+                                definitions, alias_sources, mtimes)
 
-def load_aliases():
+def resolve_alias_chains(definitions):
+    # Expand alias-to-alias chains once; like the shell, a name already expanded ends the chain
     aliases = {}
-    alias_sources = {}
-    alias_files = [
-        os.path.expanduser("~/.aliases"),
-        os.path.expanduser("~/.bash_aliases"),
-        os.path.expanduser("~/.zshrc"),
-        os.path.expanduser("~/.bashrc"),
-    ]
+    for alias_name, expansion in definitions.items():
+        seen = {alias_name}
+        first_word = expansion.split(None, 1)[0]
+        while first_word in definitions and first_word not in seen:
+            seen.add(first_word)
+            expansion = definitions[first_word] + expansion[len(first_word):]
+            first_word = expansion.split(None, 1)[0]
+        aliases[alias_name] = expansion
+    return aliases
+
+def load_aliases():
+    # The compiled table is cached until any file that contributed to it, or was missing, changes
+    alias_files = [os.path.expanduser(path) for path in ALIAS_FILES]
+    key = blake2b('|'.join(alias_files).encode('utf-8'), digest_size=20).hexdigest()
+    cache_path = os.path.join(get_cache_dir(), f"aliases-{key}.cache")
+    cache = load_cache(cache_path)
+    if cache and all(get_file_mtime(path) == mtime for path, mtime in cache['mtimes'].items()):
+        return cache['aliases'], cache['alias_sources']
     
+    definitions = {}
+    alias_sources = {}
+    mtimes = {}
     for file_path in alias_files:
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    for line in f:
-                        line = line.strip()
-                        
-                        if line.startswith('alias ') and '=' in line:
-                            alias_def = line[6:]
-                            if '=' in alias_def:
-                                alias_name, alias_cmd = alias_def.split('=', 1)
-                                alias_cmd = alias_cmd.strip().strip('\'"')
-                                if alias_cmd:
-                                    base_cmd = alias_cmd.split()[0]
-                                    aliases[alias_name.strip()] = base_cmd
-                                    alias_sources[alias_name.strip()] = os.path.basename(file_path)
-                                
-            except Exception:
-                continue
+        read_alias_file(file_path, definitions, alias_sources, mtimes)
+    aliases = resolve_alias_chains(definitions)
     
+    save_cache(cache_path, {
+        'version': CACHE_VERSION,
+        'mtimes': mtimes,
+        'aliases': aliases,
+        'alias_sources': alias_sources,
+    })
     return aliases, alias_sources
 
-def show_alias_summary(aliases, alias_sources, history, resolved_history):
+def show_alias_summary(aliases, alias_sources, alias_counts):
     if not aliases:
         return {}
     
     used_aliases = []
     alias_contributions = {}
     
-    for alias_name, resolved_cmd in aliases.items():
+    for alias_name, expansion in aliases.items():
+        resolved_cmd = expansion.split()[0]
         if alias_name != resolved_cmd:
-            alias_count = sum(1 for cmd, _ in history if cmd.split()[0] == alias_name)
+            alias_count = alias_counts[alias_name]
             if alias_count > 0:
-                used_aliases.append(f"{alias_name}→{resolved_cmd}")
+                used_aliases.append(f"{alias_name}→{resolved_cmd} ({alias_count:,})")
                 if resolved_cmd not in alias_contributions:
                     alias_contributions[resolved_cmd] = []
                 alias_contributions[resolved_cmd].append(alias_name)
@@ -300,35 +1642,730 @@ def show_alias_summary(aliases, alias_sources, history, resolved_history):
 def resolve_command(command, aliases):
     return aliases.get(command, command)
 
+def alias_resolver(aliases, full_command=False):
+    # Memoized command -> (resolved command, alias used or None). Aliases map to their full
+    # expansion, and full commands get it unless the alias only adds options to a command of
+    # the same name, which doesn't count as using it.
+    base_aliases = {alias_name: expansion.split()[0] for alias_name, expansion in aliases.items()}
+    renaming = {alias_name for alias_name, base in base_aliases.items() if base != alias_name}
+    
+    def resolve_full_command(command):
+        parts = command.split()
+        if not parts:
+            return command, None
+        alias_name = parts[0]
+        if resolve_command(alias_name, base_aliases) != alias_name:
+            parts[0] = aliases[alias_name]
+        return ' '.join(parts), alias_name
+    
+    def resolve_base_command(command):
+        return resolve_command(command, base_aliases), command
+    
+    resolve = resolve_full_command if full_command else resolve_base_command
+    resolutions = {}
+    def resolution(command):
+        result = resolutions.get(command)
+        if result is None:
+            resolved, alias = resolve(command)
+            result = resolutions[command] = resolved, (alias if alias in renaming else None)
+        return result
+    return resolution
+
+def resolve_aliases(history, aliases, full_command=False, alias_counts=None):
+    # One pass resolves each record and tallies which alias it used; the work per distinct
+    # command is a single dict lookup, memoized
+    resolution = alias_resolver(aliases, full_command)
+    if isinstance(history, HistoryStore):
+        if alias_counts is not None:
+            commands = history.commands
+            for command_id, count in Counter(history.ids).items():
+                alias = resolution(commands[command_id])[1]
+                if alias is not None:
+                    alias_counts[alias] += count
+        return history.map_commands(lambda command: resolution(command)[0])
+    return _resolve_aliases(history, resolution, alias_counts)
+
+def _resolve_aliases(history, resolution, alias_counts):
+    for command, timestamp, duration in history:
+        resolved, alias = resolution(command)
+        if alias is not None and alias_counts is not None:
+            alias_counts[alias] += 1
+        yield resolved, timestamp, duration
+
+def exclusion_filter(exclude_list):
+    exclude_set = set(exclude_list)
+    return lambda command: (command.split()[0] if command else command) not in exclude_set
+
 def filter_commands(history, exclude_list):
     if not exclude_list:
         return history
     
-    exclude_set = set(exclude_list)
-    filtered = []
-    for command, timestamp in history:
-        base_cmd = command.split()[0] if command else command
-        if base_cmd not in exclude_set:
-            filtered.append((command, timestamp))
+    keep = exclusion_filter(exclude_list)
+    if isinstance(history, HistoryStore):
+        return history.select_commands(keep)
+    return _filter_commands(history, keep)
+
+def _filter_commands(history, keep):
+    kept = {}
+    for record in history:
+        command = record[0]
+        keep_record = kept.get(command)
+        if keep_record is None:
+            keep_record = kept[command] = keep(command)
+        if keep_record:
+            yield record
+
+def count_records(history, counts, key):
+    if isinstance(history, HistoryStore):
+        counts[key] += len(history)
+        return history
+    return _count_records(history, counts, key)
+
+def _count_records(history, counts, key):
+    count = 0
+    try:
+        for record in history:
+            count += 1
+            yield record
+    finally:
+        counts[key] += count
+
+def load_numpy():
+    # NumPy is optional and slow to import, so it is only loaded for large inputs
+    global _numpy
+    if os.environ.get('FREQ_BACKEND', 'auto') == 'python':
+        return None
+    if _numpy is None:
+        _numpy = False
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            pass
+    return _numpy or None
+
+def use_numpy(history):
+    if not isinstance(history, HistoryStore):
+        return False
+    if len(history) < NUMPY_MIN_RECORDS and os.environ.get('FREQ_BACKEND') != 'numpy':
+        return False
+    return load_numpy() is not None
+
+def numpy_columns(history):
+    np = load_numpy()
+    return (np.frombuffer(history.ids, dtype=np.uint32),
+            np.frombuffer(history.timestamps, dtype=np.int64),
+            np.frombuffer(history.durations, dtype=np.uint32))
+
+def first_occurrence_order(np, ids):
+    # IDs ordered by first appearance, matching Counter insertion order
+    present, first_index = np.unique(ids, return_index=True)
+    return present[np.argsort(first_index, kind='stable')]
+
+def numpy_ranker(np, commands, counts):
+    # Rank by count, breaking ties by first occurrence like Counter.most_common
+    size = len(counts)
+    keys = counts * (size + 1) + np.arange(size, 0, -1)
+    
+    def most_common(n=None):
+        if n is None or n >= size:
+            top = np.argsort(-keys, kind='stable')
+        elif n <= 0:
+            return []
+        else:
+            top = np.argpartition(-keys, n - 1)[:n]
+            top = top[np.argsort(-keys[top], kind='stable')]
+        return [(commands[i], int(counts[i])) for i in top.tolist()]
+    return most_common
+
+def numpy_daily_counts(np, timestamps):
+    # Local dates are constant within each UTC quarter hour, since every UTC offset and
+    # DST transition falls on a 15-minute boundary, so bucket by integer division first
+    quarters, inverse = np.unique(timestamps // 900, return_inverse=True)
+    quarter_counts = np.bincount(inverse.ravel(), minlength=len(quarters)).tolist()
+    
+    daily_counts = {}
+    day = None
+    day_start = day_end = 0
+    for quarter, count in zip(quarters.tolist(), quarter_counts):
+        quarter_start = quarter * 900
+        if not day_start <= quarter_start < day_end:
+            day, day_start, day_end = local_day_bounds(quarter_start)
+        daily_counts[day] = daily_counts.get(day, 0) + count
+    return daily_counts
+
+def aggregate_history_numpy(history, daily=True):
+    np = load_numpy()
+    stats = HistoryStats()
+    ids, timestamps, durations = numpy_columns(history)
+    if not len(ids):
+        return stats
+    
+    order = first_occurrence_order(np, ids)
+    counts = np.bincount(ids, minlength=len(history.commands))[order]
+    names = [history.commands[i] for i in order.tolist()]
+    stats.command_counts = Counter(dict(zip(names, counts.tolist())))
+    stats.ranker = numpy_ranker(np, names, counts)
+    stats.total = len(ids)
+    stats.first_timestamp = int(timestamps.min())
+    stats.last_timestamp = int(timestamps.max())
+    if daily:
+        stats.daily_counts = numpy_daily_counts(np, timestamps)
+    
+    timed = durations != 0
+    if timed.any():
+        timed_ids = ids[timed]
+        totals = np.bincount(timed_ids, weights=durations[timed], minlength=len(history.commands))
+        stats.command_durations = Counter({history.commands[i]: int(totals[i])
+                                           for i in first_occurrence_order(np, timed_ids).tolist()})
+    return stats
+
+def rollup_entries(np, keys, ids, size, values=None):
+    # Sums per distinct (bucket, command) pair, laid out by bucket and then by the pair's first
+    # record, as RollupTable keeps them: (bucket keys, bucket starts, command IDs, sums)
+    pairs, first_index, inverse = np.unique(keys * size + ids, return_index=True, return_inverse=True)
+    sums = np.bincount(inverse.ravel(), weights=values, minlength=len(pairs)).astype(np.uint64)
+    pair_keys = pairs // size
+    layout = np.lexsort((first_index, pair_keys))
+    pair_keys = pair_keys[layout]
+    starts = np.flatnonzero(np.diff(pair_keys, prepend=pair_keys[0] - 1))
+    return pair_keys[starts], starts, (pairs - pair_keys * size)[layout], sums[layout]
+
+def merge_rollup_entries(table, entries):
+    # Buckets past the table's last one are appended as they are; any others go through merge
+    bucket_keys, starts, ids, sums = entries
+    split = bisect_right(bucket_keys, table.keys[-1]) if len(table.keys) else 0
+    if split:
+        cut = starts[split] if split < len(starts) else len(ids)
+        buckets = {}
+        for key, start, end in zip(bucket_keys[:split].tolist(), starts[:split].tolist(),
+                                   starts[1:split].tolist() + [cut]):
+            buckets[key] = dict(zip(ids[start:end].tolist(), sums[start:end].tolist()))
+        table.merge(buckets)
+    if split < len(bucket_keys):
+        first = starts[split]
+        table.extend(bucket_keys[split:].astype('int64').tobytes(),
+                     (starts[split:] - first + len(table.ids)).astype('uint64').tobytes(),
+                     ids[first:].astype('uint32').tobytes(), sums[first:].astype('uint64').tobytes())
+
+def update_rollup_numpy(rollup, history, first_new_record, stop):
+    # update_rollup over columns, with each record's local day looked up by UTC quarter hour
+    # as in numpy_daily_counts
+    np = load_numpy()
+    ids, timestamps, durations = (column[first_new_record:stop] for column in numpy_columns(history))
+    if not len(ids):
+        return
+    size = len(history.commands)
+    
+    def column(name, dtype, fill=0):
+        values = np.full(size, fill, dtype=dtype)
+        current = np.frombuffer(rollup[name], dtype=dtype)
+        values[:len(current)] = current
+        return values
+    
+    counts = column('counts', np.uint64)
+    seconds = column('seconds', np.uint64)
+    undated = column('undated', np.uint64)
+    firsts = column('firsts', np.int64, sys.maxsize)
+    lasts = column('lasts', np.int64, -sys.maxsize)
+    timed = durations != 0
+    new_ids = first_occurrence_order(np, ids)
+    rollup['order'].extend(new_ids[counts[new_ids] == 0].tolist())
+    if timed.any():
+        new_ids = first_occurrence_order(np, ids[timed])
+        rollup['timed'].extend(new_ids[seconds[new_ids] == 0].tolist())
+    counts += np.bincount(ids, minlength=size).astype(np.uint64)
+    seconds += np.bincount(ids, weights=durations, minlength=size).astype(np.uint64)
+    
+    dated = timestamps != NO_TIMESTAMP
+    undated += np.bincount(ids[~dated], minlength=size).astype(np.uint64)
+    ids, timestamps, durations = ids[dated], timestamps[dated], durations[dated]
+    if len(ids):
+        np.minimum.at(firsts, ids, timestamps)
+        np.maximum.at(lasts, ids, timestamps)
+        last = rollup['last'] if rollup['last'] is not None else -sys.maxsize
+        rollup['ordered'] = bool(rollup['ordered'] and last <= timestamps[0]
+                                 and (timestamps[1:] >= timestamps[:-1]).all())
+        rollup['last'] = int(timestamps[-1])
+        
+        quarters, inverse = np.unique(timestamps // 900, return_inverse=True)
+        quarter_days = []
+        day_start = day_end = 0
+        for quarter in quarters.tolist():
+            quarter_start = quarter * 900
+            if not day_start <= quarter_start < day_end:
+                date, day_start, day_end = local_day_bounds(quarter_start)
+                day = date.toordinal()
+            quarter_days.append(day)
+        hours = timestamps // 3600
+        days = np.array(quarter_days, dtype=np.int64)[inverse.ravel()]
+        merge_rollup_entries(rollup['hour_counts'], rollup_entries(np, hours, ids, size))
+        merge_rollup_entries(rollup['day_counts'], rollup_entries(np, days, ids, size))
+        timed = durations != 0
+        if timed.any():
+            ids, durations = ids[timed], durations[timed]
+            merge_rollup_entries(rollup['hour_seconds'], rollup_entries(np, hours[timed], ids, size, durations))
+            merge_rollup_entries(rollup['day_seconds'], rollup_entries(np, days[timed], ids, size, durations))
+    
+    for name, values in [('counts', counts), ('seconds', seconds), ('undated', undated),
+                         ('firsts', firsts), ('lasts', lasts)]:
+        rollup[name] = array(rollup[name].typecode, values.tobytes())
+
+def correlation_columns(history, target_command):
+    # Per distinct command: whether it is a target occurrence and which base command it counts as
+    prefix = target_command + " "
+    is_target = []
+    base_ids = []
+    bases = {}
+    for command in history.commands:
+        is_target.append(command == target_command or command.startswith(prefix))
+        base = command.split(None, 1)[0] if command.strip() else command
+        base_ids.append(bases.setdefault(base, len(bases)))
+    return is_target, base_ids, list(bases)
+
+def get_command_correlations_numpy(history, target_command, window_seconds=300):
+    np = load_numpy()
+    correlations = defaultdict(int)
+    is_target, base_ids, bases = correlation_columns(history, target_command)
+    ids, timestamps, _ = numpy_columns(history)
+    order = np.argsort(timestamps, kind='stable')
+    ids = ids[order]
+    timestamps = timestamps[order]
+    
+    targets = np.array(is_target, dtype=bool)[ids]
+    target_times = timestamps[targets]
+    others = ~targets
+    other_times = timestamps[others]
+    counts = (np.searchsorted(target_times, other_times + window_seconds, side='right')
+              - np.searchsorted(target_times, other_times - window_seconds, side='left'))
+    other_bases = np.array(base_ids, dtype=np.int64)[ids[others]]
+    totals = np.bincount(other_bases, weights=counts, minlength=len(bases))
     
-    return filtered
+    # Insert in the order the sliding scan would first have counted each command
+    for base_id in first_occurrence_order(np, other_bases[counts > 0]).tolist():
+        correlations[bases[base_id]] = int(totals[base_id])
+    return correlations
 
 def get_command_correlations(history, target_command, window_seconds=300):
+    # Counts, per base command, the target occurrences within window_seconds of each of its
+    # records: two pointers over the time-sorted target timestamps keep this linear
     correlations = defaultdict(int)
+    if not len(history):
+        return correlations
+    if use_numpy(history):
+        return get_command_correlations_numpy(history, target_command, window_seconds)
+    
+    is_target, base_ids, bases = correlation_columns(history, target_command)
+    timestamps = history.timestamps
+    if all(a <= b for a, b in zip(timestamps, timestamps[1:])):
+        ids, times = history.ids, timestamps
+    else:
+        order = sorted(range(len(history)), key=timestamps.__getitem__)
+        ids = [history.ids[i] for i in order]
+        times = [timestamps[i] for i in order]
     
-    sorted_history = sorted(history, key=lambda x: x[1])
+    target_times = [t for cmd_id, t in zip(ids, times) if is_target[cmd_id]]
+    total_targets = len(target_times)
+    if not total_targets:
+        return correlations
     
-    for i, (cmd, timestamp) in enumerate(sorted_history):
-        if cmd == target_command:
-            for j in range(max(0, i-10), min(len(sorted_history), i+11)):
-                if i != j:
-                    other_cmd, other_time = sorted_history[j]
-                    if abs(other_time - timestamp) <= window_seconds and other_cmd != target_command:
-                        correlations[other_cmd] += 1
+    low = high = 0
+    for cmd_id, timestamp in zip(ids, times):
+        if is_target[cmd_id]:
+            continue
+        while low < total_targets and target_times[low] < timestamp - window_seconds:
+            low += 1
+        while high < total_targets and target_times[high] <= timestamp + window_seconds:
+            high += 1
+        if high > low:
+            correlations[bases[base_ids[cmd_id]]] += high - low
     
     return correlations
 
+def local_day_bounds(timestamp):
+    # Out-of-range timestamps are counted on the first or last day datetime can bound
+    import datetime
+    date = datetime.datetime.fromtimestamp(min(max(timestamp, 0), MAX_TIMESTAMP)).date()
+    start = datetime.datetime.combine(date, datetime.time.min)
+    return date, start.timestamp(), (start + datetime.timedelta(days=1)).timestamp()
+
+def aggregate_history_approx(history, daily=True, capacity=APPROX_CAPACITY):
+    # Same aggregates as aggregate_history, but command counts go into a fixed-size sketch
+    # and per-command durations aren't kept, so memory doesn't grow with distinct commands
+    stats = HistoryStats()
+    sketch = stats.sketch = CommandSketch(capacity)
+    add = sketch.add
+    daily_counts = {}
+    total = 0
+    first = last = None
+    day = None
+    day_start = day_end = 0
+    
+    for command, timestamp, duration in history:
+        total += 1
+        add(command)
+        if first is None:
+            first = last = timestamp
+        elif timestamp < first:
+            first = timestamp
+        elif timestamp > last:
+            last = timestamp
+        if daily:
+            if not day_start <= timestamp < day_end:
+                day, day_start, day_end = local_day_bounds(timestamp)
+            daily_counts[day] = daily_counts.get(day, 0) + 1
+    
+    stats.total = total
+    stats.first_timestamp = first
+    stats.last_timestamp = last
+    stats.daily_counts = daily_counts
+    return stats
+
+def aggregate_store(history):
+    # Without per-day counts every column can be reduced by builtins, with no loop over records
+    stats = HistoryStats()
+    commands = history.commands
+    durations = defaultdict(int)
+    for key, duration in zip(compress(history.ids, history.durations), filter(None, history.durations)):
+        durations[key] += duration
+    
+    stats.command_counts = Counter({commands[key]: count for key, count in Counter(history.ids).items()})
+    stats.command_durations = Counter({commands[key]: seconds for key, seconds in durations.items()})
+    stats.total = len(history)
+    if stats.total:
+        stats.first_timestamp = min(history.timestamps)
+        stats.last_timestamp = max(history.timestamps)
+    return stats
+
+def aggregate_history(history, daily=True, approx=None):
+    if approx:
+        return aggregate_history_approx(history, daily, approx)
+    if use_numpy(history):
+        return aggregate_history_numpy(history, daily)
+    if isinstance(history, HistoryStore) and not daily:
+        return aggregate_store(history)
+
+    stats = HistoryStats()
+    if isinstance(history, HistoryStore):
+        records = zip(history.ids, history.timestamps, history.durations)
+    else:
+        records = history
+    
+    counts = {}
+    durations = {}
+    daily_counts = {}
+    total = 0
+    first = last = None
+    day = None
+    day_start = day_end = 0
+    
+    for key, timestamp, duration in records:
+        total += 1
+        counts[key] = counts.get(key, 0) + 1
+        if duration:
+            durations[key] = durations.get(key, 0) + duration
+        if first is None:
+            first = last = timestamp
+        elif timestamp < first:
+            first = timestamp
+        elif timestamp > last:
+            last = timestamp
+        if daily:
+            # Histories are mostly time-ordered, so the day boundaries are rarely recomputed
+            if not day_start <= timestamp < day_end:
+                day, day_start, day_end = local_day_bounds(timestamp)
+            daily_counts[day] = daily_counts.get(day, 0) + 1
+    
+    if isinstance(history, HistoryStore):
+        commands = history.commands
+        stats.command_counts = Counter({commands[key]: count for key, count in counts.items()})
+        stats.command_durations = Counter({commands[key]: seconds for key, seconds in durations.items()})
+    else:
+        stats.command_counts = Counter(counts)
+        stats.command_durations = Counter(durations)
+    stats.total = total
+    stats.first_timestamp = first
+    stats.last_timestamp = last
+    stats.daily_counts = daily_counts
+    return stats
+
+def rollup_day_bounds(ordinal):
+    import datetime
+    start = datetime.datetime.combine(datetime.date.fromordinal(ordinal), datetime.time.min)
+    return int(start.timestamp()), int((start + datetime.timedelta(days=1)).timestamp())
+
+def rollup_pieces(rollup, timestamps, records, start_time, end_time):
+    # Splits a date range into the local days and hours it covers whole and the runs of records
+    # at its ragged edges, in time order: (table, position, None) for a bucket of the day or
+    # hour table, (None, start, end) for records. Needs time-ordered records.
+    import datetime
+    lo = start_time or -sys.maxsize
+    hi = end_time or sys.maxsize
+    pieces = []
+    
+    def add_records(first, last):
+        start = bisect_left(timestamps, first, 0, records)
+        end = bisect_right(timestamps, last, 0, records)
+        if start < end:
+            pieces.append((None, start, end))
+    
+    def add_partial_days(first, last):
+        # Whole hours that fall within one local day come from the hour table
+        hours = rollup['hour_counts']
+        cursor = first
+        for position in range(*hours.positions(-(-first // 3600), (last + 1) // 3600 - 1)):
+            hour_start = hours.keys[position] * 3600
+            if datetime.date.fromtimestamp(hour_start) != datetime.date.fromtimestamp(hour_start + 3599):
+                continue
+            add_records(cursor, hour_start - 1)
+            pieces.append(('hour', position, None))
+            cursor = hour_start + 3600
+        add_records(cursor, last)
+    
+    days = rollup['day_counts']
+    first_day = datetime.date.fromtimestamp(start_time).toordinal() if start_time else 0
+    last_day = datetime.date.fromtimestamp(end_time).toordinal() if end_time else sys.maxsize
+    cursor = lo
+    for position in range(*days.positions(first_day, last_day)):
+        day_start, day_end = rollup_day_bounds(days.keys[position])
+        if lo <= day_start and day_end - 1 <= hi:
+            add_partial_days(cursor, day_start - 1)
+            pieces.append(('day', position, None))
+            cursor = day_end
+    add_partial_days(cursor, hi)
+    return pieces
+
+def aggregate_history_rollup(history, rollup, options, record_counts, alias_counts):
+    # The pipeline answered from the rollup: per-command totals without a date filter, and
+    # with one the days and hours inside the range, reading records only at its edges
+    ids, timestamps, durations = history.ids, history.timestamps, history.durations
+    records = rollup['records']
+    date_filter = options['date_filter']
+    
+    if date_filter:
+        # Summing buckets in time order only keeps first-occurrence tie ranking when that is
+        # also file order; records from a partially written last line are never rolled up,
+        # and undated ones are never bucketed
+        if not rollup['ordered'] or any(rollup['undated']) or any(b < a for a, b in zip(timestamps[max(records - 1, 0):],
+                                                              timestamps[records:])):
+            return None
+        start_time, end_time = date_filter
+        pieces = rollup_pieces(rollup, timestamps, records, start_time, end_time)
+        start = bisect_left(timestamps, start_time or -sys.maxsize, records)
+        end = bisect_right(timestamps, end_time or sys.maxsize, records)
+    else:
+        days = rollup['day_counts']
+        pieces = [('day', position, None) for position in range(len(days.keys))]
+        start, end = records, len(history)
+    if start < end:
+        pieces.append((None, start, end))
+    
+    counts = {}
+    seconds = {}
+    def add(totals, entries):
+        get = totals.get
+        for command_id, value in entries:
+            totals[command_id] = get(command_id, 0) + value
+    
+    if date_filter:
+        for table, start, end in pieces:
+            if table is None:
+                add(counts, Counter(ids[start:end]).items())
+                timed = durations[start:end]
+                add(seconds, zip(compress(ids[start:end], timed), filter(None, timed)))
+                continue
+            bucket_counts = rollup[table + '_counts']
+            first, last = bucket_counts.bounds(start)
+            add(counts, zip(bucket_counts.ids[first:last], bucket_counts.values[first:last]))
+            bucket_seconds = rollup[table + '_seconds']
+            position = bisect_left(bucket_seconds.keys, bucket_counts.keys[start])
+            if position < len(bucket_seconds.keys) and bucket_seconds.keys[position] == bucket_counts.keys[start]:
+                first, last = bucket_seconds.bounds(position)
+                add(seconds, zip(bucket_seconds.ids[first:last], bucket_seconds.values[first:last]))
+    else:
+        totals, total_seconds = rollup['counts'], rollup['seconds']
+        counts = {command_id: totals[command_id] for command_id in rollup['order']}
+        seconds = {command_id: total_seconds[command_id] for command_id in rollup['timed']}
+        add(counts, Counter(ids[start:end]).items())
+        timed = durations[start:end]
+        add(seconds, zip(compress(ids[start:end], timed), filter(None, timed)))
+    
+    # Each distinct command goes through the pipeline's stages once: the early command
+    # filter, alias resolution, exclusion and the command filter, 3 when it passes them all
+    resolution = alias_resolver(options['aliases'], options['full_command']) if options['aliases'] else None
+    keep_command = exclusion_filter(options['exclude']) if options['exclude'] else None
+    early_match = command_matcher(options['command_filter']) if options['command_filter'] else None
+    match = command_matcher(options['command']) if options['command'] else None
+    names = []
+    stages = []
+    for command in history.commands:
+        alias = None
+        stage = 0
+        if early_match is None or early_match(command):
+            if resolution is not None:
+                command, alias = resolution(command)
+            stage = 1
+            if keep_command is None or keep_command(command):
+                stage = 3 if match is None or match(command) else 2
+        names.append((command, alias))
+        stages.append(stage)
+    keep = [stage == 3 for stage in stages]
+    
+    stats = HistoryStats()
+    in_range = parsed = not_excluded = 0
+    for command_id, count in counts.items():
+        in_range += count
+        stage = stages[command_id]
+        if not stage:
+            continue
+        parsed += count
+        command, alias = names[command_id]
+        if alias is not None:
+            alias_counts[alias] += count
+        if stage >= 2:
+            not_excluded += count
+        if stage == 3:
+            stats.command_counts[command] += count
+            stats.total += count
+    record_counts['parsed'] += parsed
+    if options['exclude']:
+        record_counts['excluded'] += not_excluded
+    if options['command']:
+        record_counts['matched'] += stats.total
+    profile_count('dropped by date filter', len(history) - in_range)
+    profile_count('dropped by command filter', in_range - parsed)
+    for command_id, total in seconds.items():
+        if keep[command_id]:
+            stats.command_durations[names[command_id][0]] += total
+    
+    if not stats.total:
+        return stats
+    
+    # First and last kept record: the first piece holding one, scanned record by record
+    def piece_records(piece):
+        table, start, end = piece
+        if table is None:
+            return start, end
+        key = rollup[table + '_counts'].keys[start]
+        first, last = (key * 3600, key * 3600 + 3600) if table == 'hour' else rollup_day_bounds(key)
+        return bisect_left(timestamps, first, 0, records), bisect_right(timestamps, last - 1, 0, records)
+    
+    if date_filter:
+        for piece in pieces:
+            start, end = piece_records(piece)
+            index = next(compress(range(start, end), map(keep.__getitem__, ids[start:end])), None)
+            if index is not None:
+                stats.first_timestamp = timestamps[index]
+                break
+        for piece in reversed(pieces):
+            start, end = piece_records(piece)
+            index = next(compress(reversed(range(start, end)), map(keep.__getitem__, reversed(ids[start:end]))),
+                         None)
+            if index is not None:
+                stats.last_timestamp = timestamps[index]
+                break
+    else:
+        # Commands only ever seen undated have no first or last in the rollup
+        kept = [command_id for command_id in rollup['order'] if keep[command_id]]
+        kept_timestamps = list(compress(timestamps[records:], map(keep.__getitem__, ids[records:])))
+        undated = sum(map(rollup['undated'].__getitem__, kept))
+        now = int(time.time())
+        if undated:
+            kept_timestamps.append(now)
+        firsts = [timestamp for timestamp in map(rollup['firsts'].__getitem__, kept) if timestamp != sys.maxsize]
+        lasts = [timestamp for timestamp in map(rollup['lasts'].__getitem__, kept) if timestamp != -sys.maxsize]
+        stats.first_timestamp = min(chain(firsts, kept_timestamps))
+        stats.last_timestamp = max(chain(lasts, kept_timestamps))
+    
+    if options['daily'] and not options['command']:
+        import datetime
+        daily_counts = stats.daily_counts
+        everything = all(keep)
+        for table, start, end in pieces:
+            if table is None:
+                day_start = day_end = 0
+                for command_id, timestamp in zip(ids[start:end], timestamps[start:end]):
+                    if keep[command_id]:
+                        if not day_start <= timestamp < day_end:
+                            day, day_start, day_end = local_day_bounds(timestamp)
+                        daily_counts[day] = daily_counts.get(day, 0) + 1
+                continue
+            bucket_counts = rollup[table + '_counts']
+            key = bucket_counts.keys[start]
+            day = datetime.date.fromtimestamp(key * 3600) if table == 'hour' else datetime.date.fromordinal(key)
+            if everything:
+                count = bucket_counts.total(start)
+            else:
+                first, last = bucket_counts.bounds(start)
+                count = sum(compress(bucket_counts.values[first:last],
+                                     map(keep.__getitem__, bucket_counts.ids[first:last])))
+            if count:
+                daily_counts[day] = daily_counts.get(day, 0) + count
+        if not date_filter and undated:
+            today = datetime.date.fromtimestamp(now)
+            daily_counts[today] = daily_counts.get(today, 0) + undated
+    return stats
+
+def parse_history_rollup(history_file, shell_type, options, record_counts, alias_counts):
+    # A single cached history is aggregated from its rollup; None when that can't answer the query
+    parser = get_history_parser(shell_type)
+    if parser is None:
+        return None
+    cache_path = get_cache_path(history_file, shell_type, options['full_command'])
+    if options['date_filter']:
+        # Loading the store and the rollup costs more than parsing a few blocks of the file
+        index = load_cache(get_index_path(cache_path))
+        if index and not index.get('compressed'):
+            first, stop = find_index_blocks(index, options['date_filter'])
+            if stop - first <= RANGE_PARSE_BLOCKS:
+                return None
+    with ProfileStage('parse'):
+        result = update_history_cache(history_file, parser, shell_type, options['full_command'])
+        if result is None:
+            return None
+        cache, pending = result
+        history = cached_history(cache, pending)
+    with ProfileStage('rollup load'):
+        rollup = load_rollup(cache_path, cache)
+    if rollup is None:
+        return None
+    with ProfileStage('rollup aggregation'):
+        return aggregate_history_rollup(history, rollup, options, record_counts, alias_counts)
+
+def run_pipeline(history, options, record_counts, alias_counts):
+    # Compose the remaining stages lazily; nothing is read until aggregation
+    history = count_records(history, record_counts, 'parsed')
+    
+    # On a stream these stages only compose generators and the work happens in aggregation;
+    # --profile hands over a HistoryStore, so each stage is timed on its own
+    if options['aliases']:
+        with ProfileStage('alias resolution'):
+            history = resolve_aliases(history, options['aliases'], options['full_command'], alias_counts)
+    
+    if options['exclude']:
+        with ProfileStage('exclusion'):
+            history = filter_commands(history, options['exclude'])
+        history = count_records(history, record_counts, 'excluded')
+    
+    if options['command']:
+        correlations = None
+        if options['correlations']:
+            # Correlations look at everything run around the target, so they need the unfiltered records
+            history = HistoryStore.from_records(history)
+            with ProfileStage('correlations'):
+                correlations = get_command_correlations(history, options['command'], options['window'])
+        with ProfileStage('command filter'):
+            history = filter_by_command(history, options['command'])
+        history = count_records(history, record_counts, 'matched')
+        with ProfileStage('aggregation'):
+            stats = aggregate_history(history, daily=False, approx=options['approx'])
+        stats.correlations = correlations
+        return stats
+    with ProfileStage('aggregation'):
+        return aggregate_history(history, daily=options['daily'], approx=options['approx'])
+
 def parse_date_filter(date_filter):
+    import datetime
     now = datetime.datetime.now()
     
     if date_filter == "1h" or date_filter == "hour":
@@ -362,40 +2399,45 @@ def parse_date_filter(date_filter):
                 end_time = int((date_obj + datetime.timedelta(days=1)).timestamp())
                 return start_time, end_time
         except ValueError:
-            print(f"Error: Invalid date format '{date_filter}'")
-            print("Use: 1h, 24h, day, week, month, year, today, YYYY-MM-DD, or YYYY-MM-DD:YYYY-MM-DD")
+            print(f"Error: Invalid date format '{date_filter}'", file=sys.stderr)
+            print("Use: 1h, 24h, day, week, month, year, today, YYYY-MM-DD, or YYYY-MM-DD:YYYY-MM-DD", file=sys.stderr)
             return None, None
 
-def show_command_analysis(history, target_command, num_commands=10, show_timeline=False, show_correlations=False):
-    if not history:
+def show_command_analysis(history, target_command, num_commands=10, show_timeline=False, show_correlations=False,
+                          window_seconds=300):
+    import datetime
+    correlations = None
+    if show_correlations and isinstance(history, HistoryStore):
+        correlations = get_command_correlations(history, target_command, window_seconds)
+        history = filter_by_command(history, target_command)
+    stats = history if isinstance(history, HistoryStats) else aggregate_history(history, daily=False)
+    if correlations is None:
+        correlations = stats.correlations
+    if not stats.total:
         print(f"No '{target_command}' commands found in history")
         return
     
-    most_common = Counter([item[0] for item in history]).most_common(num_commands)
+    most_common = stats.most_common(num_commands)
     actual_count = len(most_common)
     print(f"=== TOP {actual_count} '{target_command.upper()}' VARIATIONS ===")
-    print(f"Total '{target_command}' executions: {len(history):,}")
+    print(f"Total '{target_command}' executions: {stats.total:,}")
     print()
     
     for i, (command, count) in enumerate(most_common, 1):
         display_cmd = command if len(command) <= 50 else command[:47] + "..."
-        print(f"{i:2d}. {display_cmd:<50} ({count:,} times)")
+        print(f"{i:2d}. {display_cmd:<50} ({count:,} times{format_count_error(stats, command)})")
+    show_approx_note(stats)
     
-    if show_correlations and len(history) > 1:
-        correlations = get_command_correlations(history, target_command)
-        if correlations:
-            print(f"\n=== COMMANDS OFTEN USED WITH '{target_command.upper()}' ===")
-            top_correlations = sorted(correlations.items(), key=lambda x: x[1], reverse=True)[:5]
-            for cmd, count in top_correlations:
-                print(f"  {cmd:<20} ({count} times)")
+    if show_correlations and correlations:
+        print(f"\n=== COMMANDS OFTEN USED WITH '{target_command.upper()}' ===")
+        top_correlations = sorted(correlations.items(), key=lambda x: x[1], reverse=True)[:5]
+        for cmd, count in top_correlations:
+            print(f"  {cmd:<20} ({count} times)")
     
     if show_timeline:
-        timestamps = [item[1] for item in history]
-        if timestamps:
-            most_recent = max(timestamps)
-            oldest = min(timestamps)
-            recent_date = datetime.datetime.fromtimestamp(most_recent)
-            oldest_date = datetime.datetime.fromtimestamp(oldest)
+        if stats.total:
+            recent_date = datetime.datetime.fromtimestamp(stats.last_timestamp)
+            oldest_date = datetime.datetime.fromtimestamp(stats.first_timestamp)
             
             print(f"\n=== USAGE TIMELINE ===")
             print(f"First used: {oldest_date.strftime('%B %d, %Y at %H:%M')}")
@@ -403,24 +2445,26 @@ def show_command_analysis(history, target_command, num_commands=10, show_timelin
             
             total_days = (recent_date - oldest_date).days + 1
             if total_days > 0:
-                avg_per_day = len(history) / total_days
+                avg_per_day = stats.total / total_days
                 print(f"Average:    {avg_per_day:.1f} times per day over {total_days} days")
 
-def smart_defaults(args):
+def smart_defaults(args, argv=None):
     # Auto-enable timeline for development commands
     if args.command:
         dev_commands = ['git', 'python', 'python3', 'node', 'npm', 'cargo', 'go', 'java', 'mvn', 'gradle']
         if args.command.lower() in dev_commands and not args.timeline:
             args.timeline = True
-            if not args.debug:
+            if not args.debug and args.format == 'text':
                 print(f"Auto-enabled timeline for {args.command}")
     
     # Auto-detect recent activity requests
     recent_keywords = ['today', 'recent', 'latest', 'now']
-    if any(keyword in ' '.join(sys.argv).lower() for keyword in recent_keywords):
+    if argv is None:
+        argv = sys.argv
+    if any(keyword in ' '.join(argv).lower() for keyword in recent_keywords):
         if not args.date:
             args.date = '24h'
-            if not args.debug:
+            if not args.debug and args.format == 'text':
                 print("Auto-filtered to last 24 hours")
     
     # Smart number defaults
@@ -431,45 +2475,63 @@ def smart_defaults(args):
     
     return args
 
+def format_duration(seconds):
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+def format_count_error(stats, command):
+    error = stats.count_error(command)
+    return f" ±{error:,}" if error else ""
+
+def show_approx_note(stats):
+    if stats.sketch is not None:
+        bound = stats.sketch.frequencies.error_bound()
+        print(f"(approximate: counts are upper bounds, off by at most the ± shown; "
+              f"others by up to {bound:,} with 99% confidence)")
+
 def show_basic_analysis(history, num_commands=10):
-    if not history:
+    stats = history if isinstance(history, HistoryStats) else aggregate_history(history, daily=False)
+    if not stats.total:
         print("No commands found in history")
         return
     
-    most_common = Counter([item[0] for item in history]).most_common(num_commands)
+    most_common = stats.most_common(num_commands)
     for i, (command, count) in enumerate(most_common, 1):
-        print(f"{i:2d}. {command:<15} {count}")
+        print(f"{i:2d}. {command:<15} {count}{format_count_error(stats, command)}")
+    show_approx_note(stats)
 
 def show_advanced_analysis(history, num_commands=10):
-    if not history:
+    import datetime
+    stats = history if isinstance(history, HistoryStats) else aggregate_history(history)
+    if not stats.total:
         print("No commands found in history")
         return
     
-    print(f"Analyzed {len(history):,} commands\n")
+    print(f"Analyzed {stats.total:,} commands\n")
     
     print(f"=== TOP {num_commands} MOST USED COMMANDS ===")
-    most_common = Counter([item[0] for item in history]).most_common(num_commands)
+    most_common = stats.most_common(num_commands)
     for i, (command, count) in enumerate(most_common, 1):
-        print(f"{i:2d}. {command:<15} ({count:,} times)")
+        print(f"{i:2d}. {command:<15} ({count:,} times{format_count_error(stats, command)})")
+    show_approx_note(stats)
     
-    timestamps = [item[1] for item in history]
-    if timestamps:
-        start_date = datetime.datetime.fromtimestamp(min(timestamps))
-        end_date = datetime.datetime.fromtimestamp(max(timestamps))
-        total_days = (end_date - start_date).days + 1
-        
-        print(f"\n=== TIME RANGE ANALYSIS ===")
-        print(f"Data from: {start_date.strftime('%B %d, %Y')}")
-        print(f"Data to:   {end_date.strftime('%B %d, %Y')}")
-        print(f"Total days: {total_days:,}")
-        print(f"Average commands per day: {len(history) / total_days:.1f}")
+    start_date = datetime.datetime.fromtimestamp(stats.first_timestamp)
+    end_date = datetime.datetime.fromtimestamp(stats.last_timestamp)
+    total_days = (end_date - start_date).days + 1
     
-    print(f"\n=== DAILY ACTIVITY ANALYSIS ===")
-    daily_counts = defaultdict(int)
-    for _, timestamp in history:
-        date = datetime.datetime.fromtimestamp(timestamp).date()
-        daily_counts[date] += 1
+    print(f"\n=== TIME RANGE ANALYSIS ===")
+    print(f"Data from: {start_date.strftime('%B %d, %Y')}")
+    print(f"Data to:   {end_date.strftime('%B %d, %Y')}")
+    print(f"Total days: {total_days:,}")
+    print(f"Average commands per day: {stats.total / total_days:.1f}")
     
+    print(f"\n=== DAILY ACTIVITY ANALYSIS ===")
+    daily_counts = stats.daily_counts
     if daily_counts:
         max_day = max(daily_counts.values())
         min_day = min(daily_counts.values())
@@ -481,39 +2543,558 @@ def show_advanced_analysis(history, num_commands=10):
         print(f"Days with activity: {len(daily_counts):,}")
     
     print(f"\n=== COMMAND DIVERSITY ===")
-    unique_commands = len(set(item[0] for item in history))
-    print(f"Unique commands: {unique_commands:,}")
-    print(f"Total executions: {len(history):,}")
-    print(f"Average uses per command: {len(history) / unique_commands:.1f}")
+    # Estimates from --approx are marked, unless every distinct command still fit in the sample
+    about = "~" if stats.sketch is not None and not stats.sketch.exact_diversity else ""
+    unique_commands = stats.unique_commands
+    print(f"Unique commands: {about}{unique_commands:,}")
+    print(f"Total executions: {stats.total:,}")
+    print(f"Average uses per command: {about}{stats.total / unique_commands:.1f}")
+    
+    single_use = stats.single_use_commands
+    print(f"Commands used only once: {about}{single_use:,} ({single_use/unique_commands*100:.1f}%)")
+    
+    # Only zsh histories that record durations (e.g. INC_APPEND_HISTORY_TIME) have these
+    if stats.command_durations:
+        print(f"\n=== LONGEST RUNNING COMMANDS ===")
+        for i, (command, total) in enumerate(stats.command_durations.most_common(5), 1):
+            average = total / stats.command_counts[command]
+            print(f"{i:2d}. {command:<15} ({format_duration(total)} total, {average:.1f}s average)")
+
+def group_fleet_stats(users, file_stats):
+    user_stats = {}
+    for user, stats in zip(users, file_stats):
+        user_stats.setdefault(user, HistoryStats()).merge(stats)
+    return sorted(user_stats.items(), key=lambda item: item[1].total, reverse=True)
+
+def show_fleet_summary(users, file_stats):
+    user_stats = group_fleet_stats(users, file_stats)
+    print(f"=== PER-USER SUMMARY ({len(user_stats)} users) ===")
+    for user, stats in user_stats:
+        top_commands = ', '.join(command for command, count in stats.most_common(3))
+        print(f"{user:<15} {stats.total:>10,} commands  {top_commands}")
+    print()
+
+# Structured counterparts of the reports above: flat records tagged with their section,
+# using the REPORT_FIELDS keys. Sections of "metric" records describe a single object.
+
+def metric_records(section, metrics):
+    for metric, value in metrics:
+        yield {'section': section, 'metric': metric, 'value': value}
+
+def format_timestamp(timestamp):
+    import datetime
+    return datetime.datetime.fromtimestamp(timestamp).isoformat()
+
+def fleet_report(users, file_stats):
+    for rank, (user, stats) in enumerate(group_fleet_stats(users, file_stats), 1):
+        yield {'section': 'users', 'rank': rank, 'user': user, 'count': stats.total}
+
+def basic_report(history, num_commands=10, section='top_commands'):
+    stats = history if isinstance(history, HistoryStats) else aggregate_history(history, daily=False)
+    for rank, (command, count) in enumerate(stats.most_common(num_commands), 1):
+        record = {'section': section, 'rank': rank, 'command': command, 'count': count}
+        if stats.sketch is not None:
+            # Upper bound on how much the approximate count may exceed the true one
+            record['value'] = stats.count_error(command)
+        yield record
+
+def advanced_report(history, num_commands=10):
+    import datetime
+    stats = history if isinstance(history, HistoryStats) else aggregate_history(history)
+    yield from basic_report(stats, num_commands)
+    if not stats.total:
+        return
+    
+    start_date = datetime.datetime.fromtimestamp(stats.first_timestamp)
+    end_date = datetime.datetime.fromtimestamp(stats.last_timestamp)
+    total_days = (end_date - start_date).days + 1
+    daily_counts = stats.daily_counts
+    yield from metric_records('summary', [
+        ('first_timestamp', format_timestamp(stats.first_timestamp)),
+        ('last_timestamp', format_timestamp(stats.last_timestamp)),
+        ('total_days', total_days),
+        ('total_commands', stats.total),
+        ('average_per_day', stats.total / total_days),
+        ('active_days', len(daily_counts)),
+        ('most_active_day', max(daily_counts.values()) if daily_counts else 0),
+        ('least_active_day', min(daily_counts.values()) if daily_counts else 0),
+        ('unique_commands', stats.unique_commands),
+        ('single_use_commands', stats.single_use_commands),
+    ])
+    
+    for day in sorted(daily_counts):
+        yield {'section': 'daily_activity', 'date': day.isoformat(), 'count': daily_counts[day]}
+    
+    for rank, (command, total) in enumerate(stats.command_durations.most_common(num_commands), 1):
+        yield {'section': 'durations', 'rank': rank, 'command': command,
+               'count': stats.command_counts[command], 'value': total}
+
+def command_report(history, target_command, num_commands=10, show_timeline=False, show_correlations=False,
+                   window_seconds=300):
+    import datetime
+    correlations = None
+    if show_correlations and isinstance(history, HistoryStore):
+        correlations = get_command_correlations(history, target_command, window_seconds)
+        history = filter_by_command(history, target_command)
+    stats = history if isinstance(history, HistoryStats) else aggregate_history(history, daily=False)
+    if correlations is None:
+        correlations = stats.correlations
+    
+    yield from basic_report(stats, num_commands, section='variations')
+    
+    if show_correlations and correlations:
+        top_correlations = sorted(correlations.items(), key=lambda x: x[1], reverse=True)[:num_commands]
+        for rank, (command, count) in enumerate(top_correlations, 1):
+            yield {'section': 'correlations', 'rank': rank, 'command': command, 'count': count}
+    
+    if show_timeline and stats.total:
+        total_days = (datetime.datetime.fromtimestamp(stats.last_timestamp)
+                      - datetime.datetime.fromtimestamp(stats.first_timestamp)).days + 1
+        yield from metric_records('timeline', [
+            ('first_used', format_timestamp(stats.first_timestamp)),
+            ('last_used', format_timestamp(stats.last_timestamp)),
+            ('total_days', total_days),
+            ('average_per_day', stats.total / total_days),
+        ])
+
+def write_report(records, output_format):
+    # NDJSON and CSV are written a record at a time; JSON groups the records by section
+    import json
+    if output_format == 'ndjson':
+        for record in records:
+            sys.stdout.write(json.dumps(record) + '\n')
+    elif output_format == 'csv':
+        import csv
+        writer = csv.DictWriter(sys.stdout, REPORT_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        report = {}
+        for record in records:
+            record = dict(record)
+            section = record.pop('section')
+            if 'metric' in record:
+                report.setdefault(section, {})[record['metric']] = record['value']
+            else:
+                report.setdefault(section, []).append(record)
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+def show_follow_view(history_file, total, top, full_command=False):
+    if sys.stdout.isatty():
+        sys.stdout.write("\033[H\033[J")
+    else:
+        print()
+    print(f"Following {history_file}: {total:,} commands (updated {time.strftime('%H:%M:%S')})")
+    for i, (command, count) in enumerate(top, 1):
+        if full_command:
+            display_cmd = command if len(command) <= 50 else command[:47] + "..."
+            print(f"{i:2d}. {display_cmd:<50} {count}")
+        else:
+            print(f"{i:2d}. {command:<15} {count}")
+    sys.stdout.flush()
+
+def follow_history(history_file, shell_type, options, num_commands=10, interval=FOLLOW_INTERVAL):
+    # Poll the file size and parse only what was appended; the view is redrawn only when the
+    # top commands or their counts change
+    if shell_type is None:
+        shell_type = detect_shell_type(history_file)
+    parser = get_history_parser(shell_type)
+    if parser is None:
+        print(f"Unknown shell type: {shell_type}", file=sys.stderr)
+        return
+    
+    file_id = None
+    offset = 0
+    shown = None
+    try:
+        while True:
+            try:
+                file_stat = os.stat(history_file)
+            except OSError:
+                # Between the unlink and rename of a rewrite; try again next time
+                file_stat = None
+            
+            if file_stat is not None:
+                if (file_stat.st_ino, file_stat.st_dev) != file_id or file_stat.st_size < offset:
+                    # New, replaced or truncated file (zsh rewrites it when trimming): start over
+                    file_id = (file_stat.st_ino, file_stat.st_dev)
+                    offset = 0
+                    stats = HistoryStats()
+                    first_seen = {}
+                    top = []
+                
+                if file_stat.st_size > offset:
+                    checkpoint = {'offset': offset, 'records': 0}
+                    records = list(parser(history_file, options['full_command'], options['date_filter'],
+                                          options['command_filter'], start_offset=offset, checkpoint=checkpoint))
+                    # A partially written last record is read again once it is complete
+                    offset = checkpoint['offset']
+                    batch = run_pipeline(records[:checkpoint['records']], options, Counter(), Counter())
+                    stats.merge(batch)
+                    
+                    # Counts only grow, so the new top N is among the old one and the commands just seen
+                    for command in batch.command_counts:
+                        first_seen.setdefault(command, len(first_seen))
+                    counts = stats.command_counts
+                    candidates = set(command for command, count in top) | set(batch.command_counts)
+                    ranked = sorted(candidates, key=lambda command: (-counts[command], first_seen[command]))
+                    top = [(command, counts[command]) for command in ranked[:num_commands]]
+                    
+                    if top != shown:
+                        show_follow_view(history_file, stats.total, top, options['full_command'])
+                        shown = top
+            
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print()
+
+class TeeOutput:
+    # Write-only text stream that copies everything to several streams as it is written
+    def __init__(self, *streams):
+        self.streams = streams
+    
+    def write(self, text):
+        for stream in self.streams:
+            stream.write(text)
+        return len(text)
     
-    single_use = [cmd for cmd, count in Counter([item[0] for item in history]).items() if count == 1]
-    print(f"Commands used only once: {len(single_use):,} ({len(single_use)/unique_commands*100:.1f}%)")
+    def flush(self):
+        for stream in self.streams:
+            stream.flush()
 
-def write_output(content, output_file):
+def write_output(func, output_file, status=None):
+    # The report is computed once and streamed to the terminal and the file together
+    from contextlib import redirect_stdout
+    
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(content)
-        print(f"\nReport saved to: {output_file}")
+        f = open(output_file, 'w', encoding='utf-8', newline='')
     except Exception as e:
-        print(f"Error writing to file: {e}")
+        print(f"Error writing to file: {e}", file=status)
+        func()
+        return
+    with f, redirect_stdout(TeeOutput(sys.stdout, f)):
+        func()
+    print(f"\nReport saved to: {output_file}", file=status)
 
-def capture_output(func, *args, **kwargs):
-    import io
-    from contextlib import redirect_stdout
+class Profiler:
+    # Wall time, CPU time and peak memory per stage plus counters, for --profile. Stages nest
+    # and their times are exclusive: a stage's figures leave out the stages run inside it.
+    def __init__(self, dump_prefix=None):
+        import resource
+        self.resource = resource
+        self.stages = {}  # name -> [calls, wall seconds, CPU seconds, peak RSS in bytes]
+        self.stack = []
+        self.counters = Counter()
+        self.start = time.perf_counter()
+        self.dump_prefix = dump_prefix
+        self.dumps = []
+        self.profile = None
+        if dump_prefix:
+            import cProfile
+            import tracemalloc
+            tracemalloc.start()
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+    
+    def cpu_time(self):
+        # Worker processes count too, once they have exited
+        children = self.resource.getrusage(self.resource.RUSAGE_CHILDREN)
+        return time.process_time() + children.ru_utime + children.ru_stime
+    
+    def peak_rss(self):
+        # High-water mark of the whole process so far; Linux reports it in kilobytes
+        return self.resource.getrusage(self.resource.RUSAGE_SELF).ru_maxrss * 1024
+    
+    def enter(self, name):
+        self.stages.setdefault(name, [0, 0.0, 0.0, 0])
+        self.stack.append([name, time.perf_counter(), self.cpu_time(), 0.0, 0.0])
+    
+    def exit(self):
+        name, wall_start, cpu_start, inner_wall, inner_cpu = self.stack.pop()
+        wall = time.perf_counter() - wall_start
+        cpu = self.cpu_time() - cpu_start
+        stage = self.stages[name]
+        stage[0] += 1
+        stage[1] += wall - inner_wall
+        stage[2] += cpu - inner_cpu
+        stage[3] = self.peak_rss()
+        if self.stack:
+            self.stack[-1][3] += wall
+            self.stack[-1][4] += cpu
+    
+    def close(self):
+        if self.profile is None:
+            return
+        import tracemalloc
+        self.profile.disable()
+        self.profile.dump_stats(f"{self.dump_prefix}.prof")
+        tracemalloc.take_snapshot().dump(f"{self.dump_prefix}.tracemalloc")
+        tracemalloc.stop()
+        self.dumps = [f"{self.dump_prefix}.prof", f"{self.dump_prefix}.tracemalloc"]
+        self.profile = None
+    
+    def report(self, output_format='table'):
+        total = time.perf_counter() - self.start
+        self.close()
+        stages = [{'stage': name, 'calls': calls, 'wall': wall, 'cpu': cpu, 'peak_rss': peak_rss}
+                  for name, (calls, wall, cpu, peak_rss) in self.stages.items()]
+        counters = {counter: count for counter, count in self.counters.items() if count}
+    
+        if output_format == 'json':
+            import json
+            report = {'total_wall': total, 'peak_rss': self.peak_rss(), 'stages': stages,
+                      'counters': counters, 'dumps': self.dumps}
+            json.dump(report, sys.stderr, indent=2)
+            sys.stderr.write('\n')
+            return
+    
+        print("\n=== PROFILE ===", file=sys.stderr)
+        print(f"{'Stage':<32} {'Calls':>5} {'Wall ms':>10} {'CPU ms':>10} {'Peak RSS MB':>12}", file=sys.stderr)
+        for stage in stages:
+            print(f"{stage['stage']:<32} {stage['calls']:>5} {stage['wall'] * 1000:>10.1f} "
+                  f"{stage['cpu'] * 1000:>10.1f} {stage['peak_rss'] / 2**20:>12.1f}", file=sys.stderr)
+        unstaged = total - sum(stage['wall'] for stage in stages)
+        print(f"{'(outside stages)':<32} {'':>5} {unstaged * 1000:>10.1f}", file=sys.stderr)
+        print(f"{'Total':<32} {'':>5} {total * 1000:>10.1f} {'':>10} {self.peak_rss() / 2**20:>12.1f}",
+              file=sys.stderr)
+        if counters:
+            print("\nCounters:", file=sys.stderr)
+            for counter, count in counters.items():
+                print(f"  {counter:<30} {count:>12,}", file=sys.stderr)
+        if self.dumps:
+            print(f"\ncProfile stats: {self.dumps[0]} (python3 -m pstats {self.dumps[0]})", file=sys.stderr)
+            print(f"tracemalloc snapshot: {self.dumps[1]} (tracemalloc.Snapshot.load)", file=sys.stderr)
+            print("Timings include the cProfile and tracemalloc overhead", file=sys.stderr)
+
+class ProfileStage:
+    # Times the enclosed code as one stage of the active profile; a no-op when not profiling
+    def __init__(self, name):
+        self.name = name
+    
+    def __enter__(self):
+        if _profiler is not None:
+            _profiler.enter(self.name)
+    
+    def __exit__(self, *exc_info):
+        if _profiler is not None:
+            _profiler.exit()
+
+def profile_count(counter, count=1):
+    if _profiler is not None and count:
+        _profiler.counters[counter] += count
+
+def get_socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or get_cache_dir()
+    return os.path.join(runtime_dir, 'freq.sock')
+
+class SocketOutput:
+    # Write-only text stream sending each write to the client as a (channel, length) frame;
+    # channel 1 is stdout, 2 is stderr, and 0 carries the exit status
+    def __init__(self, conn, channel):
+        self.conn = conn
+        self.channel = channel
+    
+    def write(self, text):
+        import struct
+        data = text.encode('utf-8', errors='surrogateescape')
+        self.conn.sendall(struct.pack('!BI', self.channel, len(data)) + data)
+        return len(text)
+    
+    def flush(self):
+        pass
+
+def set_environment(environment):
+    for name in DAEMON_ENVIRONMENT:
+        if environment.get(name) is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = environment[name]
+    time.tzset()
+
+def handle_daemon_request(conn):
+    import json
+    import struct
+    from contextlib import redirect_stderr, redirect_stdout
+    
+    request = json.loads(conn.makefile('rb').readline())
+    os.chdir(request['cwd'])
+    # The query runs in the client's environment, time zone included, and the daemon's is restored after
+    daemon_environment = {name: os.environ.get(name) for name in DAEMON_ENVIRONMENT}
+    set_environment(request['env'])
+    
+    status = 0
+    with redirect_stdout(SocketOutput(conn, 1)), redirect_stderr(SocketOutput(conn, 2)):
+        try:
+            main(request['argv'], request)
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            if isinstance(e.code, str):
+                print(e.code, file=sys.stderr)
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            status = 1
+        finally:
+            set_environment(daemon_environment)
+    conn.sendall(struct.pack('!BI', 0, status))
+
+def serve(socket_path):
+    # Caches stay in memory and are brought up to date by each query, so answering one
+    # costs a stat, parsing whatever was appended since, and the aggregation
+    global _cache_memo, _serving
+    import signal
+    import socket
+    
+    running = connect_daemon(socket_path)
+    if running is not None:
+        running.close()
+        print(f"A freq daemon is already listening on {socket_path}")
+        return
+    try:
+        os.remove(socket_path)
+    except OSError:
+        pass
+    
+    _cache_memo = {}
+    _serving = True
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    # Load the usual history files up front so the first query is already warm
+    for shell_type, history_file in find_history_files().items():
+        parse_history(history_file, shell_type=shell_type)
+        parse_history(history_file, full_command=True, shell_type=shell_type)
+    print(f"freq daemon listening on {socket_path}")
+    sys.stdout.flush()
+    
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    handle_daemon_request(conn)
+                except (OSError, ValueError, KeyError):
+                    # The client went away or sent something that isn't a request
+                    pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        try:
+            os.remove(socket_path)
+        except OSError:
+            pass
+
+def connect_daemon(socket_path):
+    if not os.path.exists(socket_path):
+        return None
+    import socket
+    
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError:
+        # A socket left behind by a daemon that didn't shut down cleanly
+        client.close()
+        return None
+    return client
+
+def query_daemon(argv, args):
+    # Returns the exit status, or None when no daemon answered and the query should run locally
+    files = None
+    if args.file:
+        # The daemon opens the files, so they are resolved here; descriptors such as /dev/stdin
+        # or a <(...) pipe, and anything else that isn't a regular file, only this process can read
+        files = [os.path.abspath(path) for path in expand_history_files(args.file)]
+        if not all(os.path.isfile(path) and not path.startswith(('/dev/', '/proc/')) for path in files):
+            return None
+    client = connect_daemon(get_socket_path())
+    if client is None:
+        return None
+    import json
+    import struct
     
-    output = io.StringIO()
-    with redirect_stdout(output):
-        func(*args, **kwargs)
-    return output.getvalue()
+    with client:
+        # The shell is detected here too, since the parent process it falls back to is this one's
+        request = {'argv': argv, 'cwd': os.getcwd(), 'shell': detect_current_shell(), 'files': files,
+                   'env': {name: os.environ[name] for name in DAEMON_ENVIRONMENT if name in os.environ}}
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        response = client.makefile('rb')
+        while True:
+            header = response.read(5)
+            if len(header) < 5:
+                print("Error: freq daemon closed the connection", file=sys.stderr)
+                return 1
+            channel, length = struct.unpack('!BI', header)
+            if channel == 0:
+                return length
+            stream = sys.stdout if channel == 1 else sys.stderr
+            stream.write(response.read(length).decode('utf-8', errors='surrogateescape'))
+            stream.flush()
 
-def main():
-    parser = argparse.ArgumentParser(description='Analyze command frequency from shell history (bash, zsh)')
+class ArgumentTable:
+    # Collects the add_argument calls, so the usual bare `freq` and `freq -n N` take their defaults
+    # without importing argparse and building a parser; anything else goes to argparse
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.arguments = []
+    
+    def add_argument(self, *flags, **kwargs):
+        self.arguments.append((flags, kwargs))
+    
+    def parse_args(self, argv):
+        if not argv or (len(argv) == 2 and argv[0] in ('-n', '--number') and argv[1].isdigit()):
+            from types import SimpleNamespace
+            args = SimpleNamespace()
+            for flags, kwargs in self.arguments:
+                dest = kwargs.get('dest') or max(flags, key=len).lstrip('-').replace('-', '_')
+                setattr(args, dest, kwargs.get('default', False if kwargs.get('action') == 'store_true' else None))
+            if argv:
+                args.number = int(argv[1])
+            return args
+        
+        import argparse
+        
+        class HelpFormatter(argparse.HelpFormatter):
+            # argparse's own formatter, built for every add_argument, sizes itself through shutil,
+            # which drags in the compression modules; os reports the terminal width just as well
+            def __init__(self, prog, indent_increment=2, max_help_position=24, width=None):
+                if width is None:
+                    try:
+                        width = int(os.environ['COLUMNS'])
+                    except (KeyError, ValueError):
+                        try:
+                            width = os.get_terminal_size(sys.__stdout__.fileno()).columns
+                        except (AttributeError, ValueError, OSError):
+                            width = 80
+                    width -= 2
+                super().__init__(prog, indent_increment, max_help_position, width)
+        
+        parser = argparse.ArgumentParser(formatter_class=HelpFormatter, **self.kwargs)
+        for flags, kwargs in self.arguments:
+            parser.add_argument(*flags, **kwargs)
+        return parser.parse_args(argv)
+
+def main(argv=None, client=None):
+    # client is the request a --serve daemon is answering: the shell and -f paths that the
+    # client process resolved itself
+    if argv is None:
+        argv = sys.argv[1:]
+    
+    parser = ArgumentTable(description='Analyze command frequency from shell history (bash, zsh)')
     parser.add_argument('-a', '--advanced', action='store_true', 
                         help='Show detailed analysis instead of just top commands')
-    parser.add_argument('-f', '--file', type=str, 
-                        help='Specify custom history file path')
+    parser.add_argument('-f', '--file', type=str, nargs='+',
+                        help='Specify custom history file paths or globs, merged by timestamp')
     parser.add_argument('-s', '--shell', type=str, choices=['bash', 'zsh', 'auto', 'all'],
-                        default='current', help='Specify shell type (current shell by default, use "all" to search all shells)')
+                        default='current', help='Specify shell type (current shell by default, use "all" to merge all shells)')
     parser.add_argument('-n', '--number', type=int, default=10,
                         help='Number of top commands to show')
     parser.add_argument('-d', '--date', type=str,
@@ -528,21 +3109,69 @@ def main():
                         help='Save output to file')
     parser.add_argument('--correlations', action='store_true',
                         help='Show command correlations (only works with -c flag)')
+    parser.add_argument('--window', type=int, default=300,
+                        help='Seconds either side of the target command counted by --correlations (default: 300)')
     parser.add_argument('--resolve-aliases', action='store_true',
                         help='Resolve shell aliases to their actual commands')
     parser.add_argument('--list-files', action='store_true',
                         help='List available history files for all shells')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Parse the history file with N worker processes, 0 for all CPUs (bypasses the parse cache)')
+    parser.add_argument('--fleet', type=str, nargs='?', const='/home', metavar='DIR',
+                        help='Analyze every user\'s history under DIR (default: /home) with a process pool')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Stream the history file instead of using the parse cache (bounded memory)')
+    parser.add_argument('--approx', type=int, nargs='?', const=APPROX_CAPACITY, metavar='K',
+                        help=f'Count commands approximately in fixed memory, tracking the top K (default: {APPROX_CAPACITY})')
+    parser.add_argument('--format', type=str, choices=['text', 'json', 'ndjson', 'csv'], default='text',
+                        help='Output format; ndjson and csv are streamed one record per line')
+    parser.add_argument('--follow', action='store_true',
+                        help='Keep watching the history file and update the top commands as they are run')
+    parser.add_argument('--serve', action='store_true',
+                        help='Run a daemon answering queries over a Unix socket; later runs become thin clients')
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='Run the query in this process even if a daemon is running')
+    parser.add_argument('--profile', type=str, nargs='?', const='table', choices=['table', 'json'],
+                        help='Report wall time, CPU time and peak memory per stage, plus counters, on stderr')
+    parser.add_argument('--profile-dump', type=str, metavar='PREFIX',
+                        help='With --profile, also write cProfile stats to PREFIX.prof and a tracemalloc snapshot '
+                             'to PREFIX.tracemalloc')
     parser.add_argument('--debug', action='store_true',
                         help='Show debug information during processing')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    
+    # With a daemon running, the CLI only forwards the query
+    if not (_serving or args.serve or args.follow or args.no_daemon):
+        status = query_daemon(argv, args)
+        if status is not None:
+            if status:
+                sys.exit(status)
+            return
+    if client is not None and client['files'] is not None:
+        args.file = client['files']
+    
+    args = smart_defaults(args, argv)
+    # Structured output keeps stdout for the report alone; status and error messages go to stderr
+    messages = sys.stdout if args.format == 'text' else sys.stderr
     
-    args = smart_defaults(args)
+    global _profiler
+    if _profiler is not None:
+        # Left behind by an earlier query to this daemon that stopped early
+        _profiler.close()
+    _profiler = None
+    if args.profile or args.profile_dump:
+        args.profile = args.profile or 'table'
+        _profiler = Profiler(args.profile_dump)
+    
+    if args.serve:
+        serve(get_socket_path())
+        return
     
     if args.list_files:
         print("Searching for history files...")
         available_files = find_history_files()
-        current_shell = detect_current_shell()
+        current_shell = client['shell'] if client is not None else detect_current_shell()
         if current_shell:
             print(f"Current shell: {current_shell}")
         
@@ -557,166 +3186,260 @@ def main():
     
     # Validate flag combinations
     if args.timeline and not args.command:
-        print("Error: -t/--timeline flag can only be used with -c/--command flag")
+        print("Error: -t/--timeline flag can only be used with -c/--command flag", file=messages)
         return
     
     if args.correlations and not args.command:
-        print("Error: --correlations flag can only be used with -c/--command flag")
+        print("Error: --correlations flag can only be used with -c/--command flag", file=messages)
+        return
+    
+    if args.approx is not None and (args.correlations or args.approx < 1):
+        print("Error: --approx needs a positive K and can't be combined with --correlations", file=messages)
+        return
+    
+    if args.fleet and (args.correlations or args.file):
+        print("Error: --fleet flag can't be combined with --correlations or -f/--file", file=messages)
+        return
+    
+    if args.follow and (args.fleet or args.correlations or args.approx or args.advanced or args.output
+                        or args.format != 'text' or args.profile):
+        print("Error: --follow only shows the top commands, as text on the terminal", file=messages)
         return
     
     # Find history file
-    if args.file:
-        history_file = args.file
-        if not os.path.exists(history_file):
-            print(f"Error: File not found: {history_file}")
+    fleet_users = None
+    if args.fleet:
+        with ProfileStage('file discovery'):
+            fleet = find_fleet_histories(args.fleet)
+        if not fleet:
+            print(f"No history files found under {args.fleet}", file=messages)
+            return
+        fleet_users = [user for user, history_file in fleet]
+        history_files = [history_file for user, history_file in fleet]
+        with ProfileStage('shell detection'):
+            shell_types = [detect_shell_type(history_file) for history_file in history_files]
+    elif args.file:
+        with ProfileStage('file discovery'):
+            history_files = expand_history_files(args.file)
+            missing = [history_file for history_file in history_files if not os.path.exists(history_file)]
+        if missing:
+            print(f"Error: File not found: {missing[0]}", file=messages)
             return
-        shell_type = args.shell if args.shell not in ['current', 'auto', 'all'] else None
+        with ProfileStage('shell detection'):
+            shell_types = [args.shell if args.shell in ['bash', 'zsh'] else detect_shell_type(history_file)
+                           for history_file in history_files]
     else:
         if args.shell == 'current':
-            current_shell = detect_current_shell()
+            with ProfileStage('shell detection'):
+                current_shell = client['shell'] if client is not None else detect_current_shell()
             if current_shell:
-                history_file = find_history_file_for_shell(current_shell)
+                with ProfileStage('file discovery'):
+                    history_file = find_history_file_for_shell(current_shell)
                 if history_file:
                     shell_type = current_shell
                 else:
-                    print(f"No history file found for current shell ({current_shell})")
-                    print("Use --list-files to see available options or -s all to search all shells")
+                    print(f"No history file found for current shell ({current_shell})", file=messages)
+                    print("Use --list-files to see available options or -s all to search all shells", file=messages)
                     return
             else:
-                print("Could not detect current shell, falling back to search all available")
+                print("Could not detect current shell, falling back to search all available", file=messages)
                 args.shell = 'all'
         
         if args.shell == 'all' or args.shell == 'auto':
-            available_files = find_history_files()
+            with ProfileStage('file discovery'):
+                available_files = find_history_files()
             if not available_files:
-                print("No shell history files found in common locations")
-                print("Use -f flag to specify custom path or --list-files to see what we're looking for")
+                print("No shell history files found in common locations", file=messages)
+                print("Use -f flag to specify custom path or --list-files to see what we're looking for",
+                      file=messages)
                 return
             
-            # Use the first available file, preferring zsh, then bash
-            for preferred_shell in ['zsh', 'bash']:
-                if preferred_shell in available_files:
-                    history_file = available_files[preferred_shell]
-                    shell_type = preferred_shell
-                    break
+            # Merge every shell's file for "all", otherwise use the first, preferring zsh, then bash
+            shell_types = [shell for shell in ['zsh', 'bash'] if shell in available_files]
+            if args.shell == 'auto':
+                shell_types = shell_types[:1]
+            history_files = [available_files[shell] for shell in shell_types]
         elif args.shell in ['bash', 'zsh']:
-            history_file = find_history_file_for_shell(args.shell)
+            with ProfileStage('file discovery'):
+                history_file = find_history_file_for_shell(args.shell)
             shell_type = args.shell
             if not history_file:
-                print(f"No {args.shell} history file found")
+                print(f"No {args.shell} history file found", file=messages)
                 return
+        
+        if args.shell != 'all' and args.shell != 'auto':
+            history_files = [history_file]
+            shell_types = [shell_type]
+    
+    if fleet_users is not None:
+        history_label = f"{len(history_files)} history files of {len(set(fleet_users))} users"
+    elif len(history_files) == 1:
+        history_label = f"{shell_types[0]} history"
+    else:
+        history_label = f"{len(history_files)} {'/'.join(dict.fromkeys(map(str, shell_types)))} history files"
     
     # Parse history with optimizations
     use_full_commands = bool(args.command)
     date_filter_parsed = None
-    command_filter = args.command if args.command else None
+    # Correlations need the commands around the target as well, so skip early command filtering
+    command_filter = args.command if args.command and not args.correlations else None
     
     if args.date:
-        date_filter_parsed = parse_date_filter(args.date)
+        with ProfileStage('date filter'):
+            date_filter_parsed = parse_date_filter(args.date)
         if date_filter_parsed[0] is None and date_filter_parsed[1] is None:
             return
     
     if args.debug:
-        print(f"Parsing {shell_type} history: {history_file}")
-        print(f"Full command mode: {use_full_commands}")
+        for history_file, shell_type in zip(history_files, shell_types):
+            print(f"Parsing {shell_type} history: {history_file}", file=messages)
+        print(f"Full command mode: {use_full_commands}", file=messages)
         if date_filter_parsed:
-            print(f"Early date filtering enabled")
+            print(f"Early date filtering enabled", file=messages)
         if command_filter:
-            print(f"Early command filtering for: {command_filter}")
-    
-    history = parse_history(history_file, full_command=use_full_commands, shell_type=shell_type, 
-                          date_filter=date_filter_parsed, command_filter=command_filter)
-    
-    if not history:
-        print("No commands found in history file")
-        return
-    
-    if not args.debug:
-        print(f"Analyzed {len(history):,} commands from {shell_type} history")
-    else:
-        print(f"Loaded {len(history):,} commands from history")
+            print(f"Early command filtering for: {command_filter}", file=messages)
+        if args.approx:
+            print(f"Approximate counting, tracking the top {args.approx}", file=messages)
+        if args.no_cache or args.approx:
+            print("Parse cache disabled", file=messages)
+        else:
+            print(f"Parse cache: {get_cache_dir()}", file=messages)
     
-    # Load aliases and resolve if requested
+    aliases = {}
     if args.resolve_aliases:
         if args.debug:
-            print("Loading and resolving aliases...")
-        aliases, alias_sources = load_aliases()
-        
-        if aliases:
-            resolved_history = []
-            for command, timestamp in history:
-                if use_full_commands:
-                    parts = command.split()
-                    if parts:
-                        resolved_cmd = resolve_command(parts[0], aliases)
-                        full_resolved = resolved_cmd + (' ' + ' '.join(parts[1:]) if len(parts) > 1 else '')
-                        resolved_history.append((full_resolved, timestamp))
-                    else:
-                        resolved_history.append((command, timestamp))
-                else:
-                    resolved_cmd = resolve_command(command, aliases)
-                    resolved_history.append((resolved_cmd, timestamp))
-            
-            alias_contributions = show_alias_summary(aliases, alias_sources, history, resolved_history)
-            history = resolved_history
+            print("Loading and resolving aliases...", file=messages)
+        with ProfileStage('alias load'):
+            aliases, alias_sources = load_aliases()
     
-    # Apply remaining filters
+    exclude_list = []
     if args.exclude:
         exclude_list = [cmd.strip() for cmd in args.exclude.split(',')]
-        original_count = len(history)
-        history = filter_commands(history, exclude_list)
-        print(f"Excluded {len(exclude_list)} commands, filtered from {original_count:,} to {len(history):,} commands")
-        print()
     
-    if args.date and not date_filter_parsed:
-        start_time, end_time = parse_date_filter(args.date)
-        if start_time is None and end_time is None:
+    options = {
+        'full_command': use_full_commands,
+        'date_filter': date_filter_parsed,
+        'command_filter': command_filter,
+        'aliases': aliases,
+        'exclude': exclude_list,
+        'command': args.command,
+        'correlations': args.correlations,
+        'window': args.window,
+        'approx': args.approx,
+        'daily': args.advanced,
+    }
+    record_counts = Counter()
+    alias_counts = Counter()
+    
+    if args.follow:
+        if len(history_files) > 1:
+            print("Error: --follow watches a single history file", file=messages)
             return
-        
-        original_count = len(history)
-        filtered = []
-        for command, timestamp in history:
-            if start_time and timestamp < start_time:
-                continue
-            if end_time and timestamp > end_time:
-                continue
-            filtered.append((command, timestamp))
-        history = filtered
-        
-        period_names = {
-            "1h": "last hour", "hour": "last hour",
-            "24h": "last 24 hours", "day": "last 24 hours", "today": "today",
-            "week": "last week", "7d": "last week",
-            "month": "last month", "30d": "last month",
-            "year": "last year", "365d": "last year"
-        }
-        period_name = period_names.get(args.date, f"date range {args.date}")
-        
-        print(f"Filtered to {len(history):,} commands from {period_name} (was {original_count:,})")
-        if not history:
-            print("No commands found in specified date range")
+        follow_history(history_files[0], shell_types[0], options, args.number)
+        return
+    
+    # Fleet mode always uses the process pool, sized to the CPUs unless -j says otherwise
+    jobs = args.jobs if args.jobs is not None else (0 if args.fleet else 1)
+    jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+    file_stats = []
+    history = None
+    if args.fleet or (jobs > 1 and not args.correlations and all(map(os.path.isfile, history_files))):
+        if args.debug:
+            print(f"Parsing in parallel with {jobs} workers", file=messages)
+        with ProfileStage('parallel parse and analysis'):
+            history = aggregate_history_parallel(history_files, shell_types, options, jobs, record_counts,
+                                                 alias_counts, file_stats if args.fleet else None)
+    elif len(history_files) == 1 and not (args.no_cache or args.approx or args.correlations):
+        history = parse_history_rollup(history_files[0], shell_types[0], options, record_counts, alias_counts)
+        if args.debug and history is not None:
+            print("Aggregated from the rollup tables", file=messages)
+    if history is None:
+        with ProfileStage('parse'):
+            history = parse_histories(history_files, full_command=use_full_commands, shell_types=shell_types,
+                                      date_filter=date_filter_parsed, command_filter=command_filter,
+                                      use_cache=not args.no_cache and not args.approx)
+            if _profiler is not None and not args.approx:
+                # Read everything now, so the parse isn't billed to whichever later stage pulls the
+                # records; --approx keeps streaming in fixed memory and bills it all to aggregation
+                history = HistoryStore.from_records(history)
+        history = run_pipeline(history, options, record_counts, alias_counts)
+    
+    if not record_counts['parsed']:
+        print("No commands found in history file", file=messages)
+        if args.format == 'text':
             return
-        print()
+        # The report holds just its meta section
+    
+    # Machine-readable formats carry these as "meta" and "aliases" records instead
+    if args.format == 'text':
+        if not args.debug:
+            print(f"Analyzed {record_counts['parsed']:,} commands from {history_label}")
+        else:
+            print(f"Loaded {record_counts['parsed']:,} commands from history")
+
+        if aliases:
+            show_alias_summary(aliases, alias_sources, alias_counts)
+
+        if exclude_list:
+            print(f"Excluded {len(exclude_list)} commands, filtered from {record_counts['parsed']:,} to {record_counts['excluded']:,} commands")
+            print()
+    
+    def report_records():
+        metrics = [('source', history_label), ('analyzed', record_counts['parsed'])]
+        if exclude_list:
+            metrics.append(('after_exclusions', record_counts['excluded']))
+        yield from metric_records('meta', metrics)
+        if not record_counts['parsed']:
+            return
+        for alias_name, count in alias_counts.items():
+            yield {'section': 'aliases', 'command': alias_name, 'count': count, 'value': aliases[alias_name]}
+        
+        if fleet_users is not None:
+            yield from fleet_report(fleet_users, file_stats)
+        if args.command:
+            yield from command_report(history, args.command, args.number, args.timeline, args.correlations,
+                                      args.window)
+        elif args.advanced:
+            yield from advanced_report(history, args.number)
+        else:
+            yield from basic_report(history, args.number)
     
     def run_analysis():
+        if args.format != 'text':
+            write_report(report_records(), args.format)
+            return
+        if fleet_users is not None:
+            show_fleet_summary(fleet_users, file_stats)
         if args.command:
-            cmd_history = []
-            for command, timestamp in history:
-                if command.startswith(args.command + " ") or command == args.command:
-                    cmd_history.append((command, timestamp))
-            show_command_analysis(cmd_history, args.command, args.number, args.timeline, args.correlations)
+            show_command_analysis(history, args.command, args.number, args.timeline, args.correlations, args.window)
         elif args.advanced:
             show_advanced_analysis(history, args.number)
         else:
             show_basic_analysis(history, args.number)
     
     # Run analysis and optionally save to file
-    if args.output:
-        output_content = capture_output(run_analysis)
-        write_output(output_content, args.output)
-        run_analysis()
-    else:
-        run_analysis()
+    with ProfileStage('rendering'):
+        if args.output:
+            write_output(run_analysis, args.output, sys.stdout if args.format == 'text' else sys.stderr)
+        else:
+            run_analysis()
+    
+    if _profiler is not None:
+        parsed = record_counts['parsed']
+        kept = record_counts['excluded'] if exclude_list else parsed
+        _profiler.counters['records accepted'] += parsed
+        _profiler.counters['dropped by exclusion'] += parsed - kept
+        if args.command:
+            _profiler.counters['dropped by command filter'] += kept - record_counts['matched']
+        _profiler.counters['records analyzed'] += len(history)
+        _profiler.report(args.profile)
+        _profiler = None
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    except BrokenPipeError:
+        # The reader stopped early, as with `| head`; point stdout at /dev/null so the
+        # interpreter's final flush doesn't fail again
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
\ No newline at end of file
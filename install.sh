@@ -16,6 +16,7 @@ NC='\033[0m' # No Color
 SCRIPT_NAME="freq.py"
 COMMAND_NAME="freq"
 INSTALL_DIR="/usr/local/bin"
+LIB_DIR="/usr/local/lib/freq"
 
 # Functions
 print_info() {
@@ -62,8 +63,19 @@ install_freq() {
         sudo mkdir -p "$INSTALL_DIR"
     fi
     
-    # Copy the script
-    sudo cp "$SCRIPT_NAME" "$INSTALL_DIR/$COMMAND_NAME"
+    # Install the script as a module along with its compiled bytecode; Python never
+    # caches bytecode for a script run directly, so every run would recompile it
+    sudo mkdir -p "$LIB_DIR"
+    sudo cp "$SCRIPT_NAME" "$LIB_DIR/$SCRIPT_NAME"
+    sudo python3 -m compileall -q "$LIB_DIR"
+
+    # Small launcher that runs the cached code as __main__, just like running the script
+    sudo tee "$INSTALL_DIR/$COMMAND_NAME" > /dev/null << EOF
+#!/usr/bin/env python3
+from importlib.machinery import SourceFileLoader
+__file__ = '$LIB_DIR/$SCRIPT_NAME'
+exec(SourceFileLoader(__name__, __file__).get_code(__name__))
+EOF
     
     # Make it executable
     sudo chmod +x "$INSTALL_DIR/$COMMAND_NAME"
@@ -98,6 +110,11 @@ uninstall_freq() {
     else
         print_warning "$COMMAND_NAME was not found in $INSTALL_DIR"
     fi
+
+    # Older installs copied the script straight into $INSTALL_DIR and have no module directory
+    if [[ -d "$LIB_DIR" ]]; then
+        sudo rm -rf "${LIB_DIR:?}"
+    fi
 }
 
 show_usage() {
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# The alias loader: definitions gathered through source/. includes, cycles between them, chains
+# of aliases expanded once, the compiled table's cache invalidated by mtime, and which aliases
+# count as used.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import freq
+
+class AliasTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='freq-test-')
+        self.addCleanup(shutil.rmtree, self.dir)
+        environment = mock.patch.dict(os.environ, HOME=self.dir, XDG_CACHE_HOME=os.path.join(self.dir, 'cache'))
+        environment.start()
+        self.addCleanup(environment.stop)
+
+    def write(self, name, text, mtime=None):
+        path = os.path.join(self.dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def read(self, *names):
+        definitions, alias_sources, mtimes = {}, {}, {}
+        for name in names:
+            freq.read_alias_file(os.path.join(self.dir, name), definitions, alias_sources, mtimes)
+        return definitions, alias_sources, mtimes
+
+class ReadAliasFileTests(AliasTestCase):
+    def test_definitions(self):
+        self.write('.bashrc', "alias gs='git status'\nalias ll=\"ls -la\"\nalias a=b c=d  # two at once\n"
+                              "alias broken='unterminated\nexport EDITOR=vim\n")
+        definitions, alias_sources, _ = self.read('.bashrc')
+        self.assertEqual(definitions['gs'], 'git status')
+        self.assertEqual(definitions['ll'], 'ls -la')
+        self.assertEqual((definitions['a'], definitions['c']), ('b', 'd'))
+        self.assertNotIn('EDITOR', definitions)
+        self.assertEqual(alias_sources['gs'], '.bashrc')
+
+    def test_sources(self):
+        self.write('.zshrc', "source ~/.config/zsh/aliases.zsh\n. $HOME/.extra\nalias k=kubectl\n")
+        self.write('.config/zsh/aliases.zsh', "alias g=git\nsource ./more.zsh\n")
+        self.write('.config/zsh/more.zsh', "alias d=docker\n")
+        self.write('.extra', "alias k='kubectl --context dev'\n")
+        definitions, alias_sources, mtimes = self.read('.zshrc')
+        self.assertEqual(definitions, {'g': 'git', 'd': 'docker', 'k': 'kubectl'})
+        self.assertEqual(alias_sources['d'], 'more.zsh')
+        self.assertEqual(len(mtimes), 4)
+
+    def test_source_cycle(self):
+        self.write('.bashrc', "alias a=one\nsource ~/.bash_aliases\n")
+        self.write('.bash_aliases', "alias b=two\n. ~/.bashrc\nsource ~/.bash_aliases\n")
+        definitions, _, mtimes = self.read('.bashrc', '.bash_aliases')
+        self.assertEqual(definitions, {'a': 'one', 'b': 'two'})
+        self.assertEqual(len(mtimes), 2)
+
+    def test_missing_files_are_recorded(self):
+        # So that creating one later invalidates the cached table
+        self.write('.bashrc', "source ~/.not-yet\n")
+        _, _, mtimes = self.read('.bashrc', '.aliases')
+        missing = [path for path, mtime in mtimes.items() if mtime is None]
+        self.assertEqual(sorted(map(os.path.basename, missing)), ['.aliases', '.not-yet'])
+
+class AliasChainTests(unittest.TestCase):
+    def test_chains(self):
+        aliases = freq.resolve_alias_chains({'g': 'git', 'gs': 'g status', 'gsv': 'gs -v', 'ls': 'ls --color=auto',
+                                             'll': 'ls -la'})
+        self.assertEqual(aliases['gs'], 'git status')
+        self.assertEqual(aliases['gsv'], 'git status -v')
+        # A name already expanded ends the chain, as in the shell
+        self.assertEqual(aliases['ls'], 'ls --color=auto')
+        self.assertEqual(aliases['ll'], 'ls --color=auto -la')
+
+    def test_cycles(self):
+        aliases = freq.resolve_alias_chains({'a': 'b x', 'b': 'a y', 'self': 'self'})
+        self.assertEqual(aliases['a'], 'a y x')
+        self.assertEqual(aliases['b'], 'b x y')
+        self.assertEqual(aliases['self'], 'self')
+
+class LoadAliasesTests(AliasTestCase):
+    def test_cache_invalidation(self):
+        self.write('.bashrc', "alias gs='git status'\nsource ~/.shared\n", mtime=1000)
+        self.write('.shared', "alias k=kubectl\n", mtime=1000)
+        aliases, _ = freq.load_aliases()
+        self.assertEqual(aliases, {'gs': 'git status', 'k': 'kubectl'})
+
+        # An unchanged set of files is served from the cache, even if a file's contents changed
+        self.write('.shared', "alias k=kubecolor\n", mtime=1000)
+        self.assertEqual(freq.load_aliases()[0]['k'], 'kubectl')
+        # A new mtime on a sourced file rebuilds it
+        self.write('.shared', "alias k=kubecolor\n", mtime=2000)
+        self.assertEqual(freq.load_aliases()[0]['k'], 'kubecolor')
+        # So does creating a file that was missing
+        self.write('.aliases', "alias d=docker\n")
+        self.assertEqual(freq.load_aliases()[0]['d'], 'docker')
+
+class AliasResolverTests(unittest.TestCase):
+    def test_used_aliases(self):
+        # An alias only adding options to a command of the same name doesn't count as used
+        aliases = {'gs': 'git status', 'ls': 'ls --color=auto', 'll': 'ls --color=auto -la'}
+        for full_command, expected in [(False, [('git', 'gs'), ('ls', None), ('ls', 'll'), ('make', None)]),
+                                       (True, [('git status', 'gs'), ('ls -a', None), ('ls --color=auto -la x', 'll'),
+                                               ('make', None)])]:
+            resolution = freq.alias_resolver(aliases, full_command)
+            commands = ['gs', 'ls -a', 'll x', 'make'] if full_command else ['gs', 'ls', 'll', 'make']
+            with self.subTest(full_command=full_command):
+                self.assertEqual([resolution(command) for command in commands], expected)
+
+if __name__ == '__main__':
+    unittest.main()
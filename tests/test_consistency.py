@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+# Consistency tests over generated histories: whichever way freq answers a query (streamed with
+# --no-cache, from the parse cache and its rollup, after appends recorded in the delta file, in
+# parallel with -j, or with the NumPy backend), it must print exactly the same output. Every
+# query runs freq in a subprocess, with its cache, home and time zone kept in a temporary
+# directory.
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FREQ = os.path.join(ROOT, 'freq.py')
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from generate_history import format_entry, generate_entries
+
+QUERIES = [
+    [],
+    ['-n', '40'],
+    ['-a'],
+    ['-x', 'ls,cd,vim', '-n', '15'],
+    ['-c', 'git', '-t'],
+    ['-c', 'git', '--correlations'],
+    ['-d', '2023-11-20:2024-01-10'],
+    ['-d', '2023-11-20:2024-01-10', '-a'],
+    ['-d', '2023-12-03'],
+    ['--format', 'json', '-a'],
+    ['--format', 'csv'],
+]
+# A shorter list for the scenarios that compare after every change to the file
+CHANGE_QUERIES = [[], ['-a'], ['-d', '2023-11-20:2024-01-10', '-a'], ['-c', 'git', '-t']]
+ZONES = ['UTC', 'Asia/Kolkata', 'America/New_York', 'Australia/Lord_Howe']
+
+def has_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return False
+    return True
+
+def mask_now(output, start, end, zone):
+    # Commands without a timestamp are dated when read, so the times a run could have given
+    # them are masked to compare runs made a second or two apart
+    for second in range(int(start), int(end) + 1):
+        now = datetime.fromtimestamp(second, ZoneInfo(zone))
+        output = output.replace(now.strftime('%Y-%m-%dT%H:%M:%S'), '<now>')
+        output = output.replace(now.strftime('%B %d, %Y at %H:%M'), '<now>')
+    return output
+
+def history_bytes(output_format, lines, seed=0, start=1700000000, shuffle=False):
+    entries = list(generate_entries(lines, seed=seed, start=start))
+    if shuffle:
+        # Out of order the way merged or restored histories are: runs of records moved about
+        blocks = [entries[i:i + 200] for i in range(0, len(entries), 200)]
+        random.Random(seed).shuffle(blocks)
+        entries = [entry for block in blocks for entry in block]
+    return b"".join(format_entry(output_format, *entry) for entry in entries)
+
+class FreqTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='freq-test-')
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.cache_dir = os.path.join(self.dir, 'cache')
+        self.env = dict(os.environ, HOME=self.dir, XDG_CACHE_HOME=self.cache_dir,
+                        XDG_RUNTIME_DIR=self.dir, SHELL='/bin/zsh', TZ='UTC', COLUMNS='100')
+        self.env.pop('FREQ_BACKEND', None)
+
+    def write(self, name, data, mode='wb'):
+        path = os.path.join(self.dir, name)
+        with open(path, mode) as f:
+            f.write(data)
+        return path
+
+    def freq(self, history, *args, **env):
+        # history=None leaves finding the history file to freq, from $SHELL and $HOME
+        env = dict(self.env, **env)
+        start = time.time()
+        files = ['-f', history] if history is not None else []
+        result = subprocess.run([sys.executable, FREQ, '--no-daemon', *files, *args],
+                                capture_output=True, text=True, env=env)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return mask_now(result.stdout, start, time.time(), env['TZ'])
+
+    def expected(self, history, query, **env):
+        return self.freq(history, '--no-cache', *query, FREQ_BACKEND='python', **env)
+
+    def assertCachedMatches(self, history, queries, **env):
+        # Cached answers, the first of which may build the rollup, against streamed ones
+        for query in queries:
+            with self.subTest(query=query, **env):
+                self.assertEqual(self.freq(history, *query, FREQ_BACKEND='python', **env),
+                                 self.expected(history, query, **env))
+
+class BackendTests(FreqTestCase):
+    def check_format(self, output_format, lines=20000):
+        history = self.write(output_format, history_bytes(output_format, lines))
+        for query in QUERIES:
+            with self.subTest(query=query):
+                expected = self.expected(history, query)
+                self.assertEqual(self.freq(history, *query, FREQ_BACKEND='python'), expected)
+                if has_numpy():
+                    self.assertEqual(self.freq(history, '--no-cache', *query, FREQ_BACKEND='numpy'), expected)
+        # Cold and warm runs against a cache and rollup built by the NumPy backend
+        if has_numpy():
+            shutil.rmtree(self.cache_dir)
+            for query in QUERIES:
+                with self.subTest(query=query, backend='numpy'):
+                    self.assertEqual(self.freq(history, *query, FREQ_BACKEND='numpy'), self.expected(history, query))
+
+    def test_zsh(self):
+        self.check_format('zsh')
+
+    def test_bash_timestamped(self):
+        self.check_format('bash_timestamped')
+
+    def test_bash_undated(self):
+        # Dated when read, so daily counts land on today in every backend
+        self.check_format('bash', lines=5000)
+
+    def test_out_of_order(self):
+        history = self.write('zsh', history_bytes('zsh', 20000, shuffle=True))
+        self.assertCachedMatches(history, QUERIES)
+
+    def test_parallel(self):
+        # Large enough to be split into several chunks
+        for output_format in ['zsh', 'bash_timestamped']:
+            history = self.write(output_format, history_bytes(output_format, 80000))
+            for query in QUERIES:
+                if '--correlations' in query:
+                    continue
+                with self.subTest(format=output_format, query=query):
+                    self.assertEqual(self.freq(history, '-j', '2', *query), self.expected(history, query))
+
+    def test_parallel_bash_shell(self):
+        # Without -f the file's type comes from $SHELL or -s, which only say bash, so chunks must
+        # still be split on the file's "#<ts>" record starts
+        self.write('.bash_history', history_bytes('bash_timestamped', 200000))
+        for query in [[], ['-a'], ['--format', 'json', '-a']]:
+            for shell_args in [['-s', 'bash'], []]:
+                with self.subTest(query=query, shell=shell_args):
+                    self.assertEqual(self.freq(None, '-j', '4', *shell_args, *query, SHELL='/bin/bash'),
+                                     self.freq(None, '--no-cache', *shell_args, *query, SHELL='/bin/bash'))
+
+    def test_pipe(self):
+        # Pipes can't be mapped or seeked, so they are read as a stream from the start
+        data = history_bytes('zsh', 5000)
+        history = self.write('zsh', data)
+        for query in [[], ['-a']]:
+            with self.subTest(query=query):
+                result = subprocess.run([sys.executable, FREQ, '--no-daemon', '-s', 'zsh', '-f', '/dev/stdin', *query],
+                                        input=data, capture_output=True, env=self.env)
+                self.assertEqual(result.returncode, 0, result.stderr)
+                self.assertEqual(result.stdout.decode('utf-8'), self.expected(history, ['-s', 'zsh', *query]))
+
+    def test_time_zones(self):
+        history = self.write('zsh', history_bytes('zsh', 20000))
+        # The cache and rollup built in UTC are reused, or rebuilt, in every other zone
+        self.freq(history)
+        for zone in ZONES:
+            self.assertCachedMatches(history, CHANGE_QUERIES, TZ=zone)
+            if has_numpy():
+                for query in CHANGE_QUERIES:
+                    with self.subTest(query=query, TZ=zone, backend='numpy'):
+                        self.assertEqual(self.freq(history, *query, FREQ_BACKEND='numpy', TZ=zone),
+                                         self.expected(history, query, TZ=zone))
+
+class OutputTests(FreqTestCase):
+    def test_structured_stdout(self):
+        # Without $SHELL, and with this test rather than a shell as the parent, freq falls back to
+        # every history it can find and says so; the note must stay off the report's stdout
+        import json
+        self.write('.zsh_history', history_bytes('zsh', 2000))
+        env = dict(self.env)
+        del env['SHELL']
+        for output_format in ['json', 'ndjson', 'csv']:
+            with self.subTest(format=output_format):
+                result = subprocess.run([sys.executable, FREQ, '--no-daemon', '--format', output_format, '-a'],
+                                        capture_output=True, text=True, env=env)
+                self.assertEqual(result.returncode, 0, result.stderr)
+                self.assertIn("Could not detect current shell", result.stderr)
+                if output_format == 'json':
+                    self.assertIn('top_commands', json.loads(result.stdout))
+                elif output_format == 'ndjson':
+                    self.assertTrue(all(json.loads(line) for line in result.stdout.splitlines()))
+                else:
+                    self.assertTrue(result.stdout.startswith('section,'))
+
+class CacheUpdateTests(FreqTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = history_bytes('zsh', 100000)
+        self.history = self.write('zsh', self.data[:len(self.data) // 4])
+        self.freq(self.history)
+
+    def append(self, data):
+        self.write('zsh', data, mode='ab')
+
+    def test_appends(self):
+        # A few small appends go to the delta file; the large one makes the cache be rewritten
+        quarter = len(self.data) // 4
+        for end in [quarter + 100, quarter + 5000, quarter + 5001, quarter + 40000, len(self.data) - 1]:
+            start = os.path.getsize(self.history)
+            self.append(self.data[start:self.data.index(b"\n", end) + 1])
+            self.assertCachedMatches(self.history, CHANGE_QUERIES)
+
+    def test_many_appends(self):
+        start = os.path.getsize(self.history)
+        for _ in range(70):
+            end = self.data.index(b"\n", start + 300) + 1
+            self.append(self.data[start:end])
+            start = end
+            self.assertEqual(self.freq(self.history), self.expected(self.history, []))
+        self.assertCachedMatches(self.history, CHANGE_QUERIES)
+
+    def test_partial_line(self):
+        start = os.path.getsize(self.history)
+        end = self.data.index(b"\n", start + 1000) + 1
+        self.append(self.data[start:end - 20])
+        self.assertCachedMatches(self.history, CHANGE_QUERIES)
+        self.append(self.data[end - 20:end])
+        self.assertCachedMatches(self.history, CHANGE_QUERIES)
+
+    def test_out_of_order_append(self):
+        self.append(history_bytes('zsh', 2000, seed=1, start=1690000000))
+        self.assertCachedMatches(self.history, CHANGE_QUERIES)
+        self.append(history_bytes('zsh', 2000, seed=2, start=1710000000))
+        self.assertCachedMatches(self.history, CHANGE_QUERIES)
+
+    def test_same_size_rewrite(self):
+        with open(self.history, 'rb') as f:
+            data = f.read()
+        stat = os.stat(self.history)
+        self.write('zsh', data.replace(b";git status\n", b";zzz status\n", 1))
+        os.utime(self.history, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+        self.assertEqual(os.path.getsize(self.history), stat.st_size)
+        self.assertCachedMatches(self.history, CHANGE_QUERIES)
+
+    def test_truncate(self):
+        self.append(self.data[os.path.getsize(self.history):len(self.data) // 3])
+        self.freq(self.history)
+        with open(self.history, 'r+b') as f:
+            f.truncate(len(self.data) // 8)
+        self.assertCachedMatches(self.history, CHANGE_QUERIES)
+
+    def test_torn_delta(self):
+        start = os.path.getsize(self.history)
+        end = self.data.index(b"\n", start + 2000) + 1
+        self.append(self.data[start:end])
+        self.freq(self.history)
+        deltas = [name for name in os.listdir(os.path.join(self.cache_dir, 'freq')) if name.endswith('.delta')]
+        self.assertEqual(len(deltas), 1)
+        delta = os.path.join(self.cache_dir, 'freq', deltas[0])
+        with open(delta, 'r+b') as f:
+            f.truncate(os.path.getsize(delta) - 10)
+        self.assertCachedMatches(self.history, CHANGE_QUERIES)
+        self.append(self.data[end:self.data.index(b"\n", end + 2000) + 1])
+        self.assertCachedMatches(self.history, CHANGE_QUERIES)
+
+class TimestampTests(FreqTestCase):
+    def test_out_of_range_zsh(self):
+        data = history_bytes('zsh', 5000)
+        odd = (b": 99999999999999:0;ls -la\n: 253402128000:0;git status\n: 9999999999999999999:0;cd\n"
+               b": 0:0;make\n: 100:3;vim\n")
+        history = self.write('zsh', data[:len(data) // 2] + odd + data[len(data) // 2:])
+        self.assertCachedMatches(history, QUERIES)
+
+    def test_partly_dated_bash(self):
+        data = history_bytes('bash_timestamped', 5000)
+        odd = b"#99999999999999\nls -la\n#abc\ngit status\nundated\n#253402128000\nmake\n#1\nvim\n"
+        history = self.write('bash', data[:len(data) // 2] + odd + data[len(data) // 2:])
+        self.assertCachedMatches(history, QUERIES)
+        if has_numpy():
+            for query in CHANGE_QUERIES:
+                with self.subTest(query=query, backend='numpy'):
+                    self.assertEqual(self.freq(history, *query, FREQ_BACKEND='numpy'), self.expected(history, query))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+# The --approx sketches, checked against exact counts on skewed command streams: the bounds each
+# one promises, and that merging the sketches of a split stream keeps them, as -j and --fleet do.
+
+import os
+import random
+import sys
+import unittest
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import freq
+
+def command_stream(records, distinct=3000, seed=0):
+    # Zipfian over `distinct` commands, so there are heavy hitters and a long tail of single uses
+    rng = random.Random(seed)
+    commands = [f"tool{rank} --flag{rank % 7}" for rank in range(distinct)]
+    return rng.choices(commands, weights=[1 / (rank + 1) for rank in range(distinct)], k=records)
+
+def split(stream, parts):
+    size = -(-len(stream) // parts)
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+class SpaceSavingTests(unittest.TestCase):
+    def build(self, stream, capacity):
+        sketch = freq.SpaceSaving(capacity)
+        for command in stream:
+            sketch.add(command)
+        return sketch
+
+    def assertBounds(self, sketch, stream):
+        true_counts = Counter(stream)
+        for command, count in sketch.counts.items():
+            self.assertLessEqual(count - sketch.errors[command], true_counts[command], command)
+            self.assertLessEqual(true_counts[command], count, command)
+            self.assertLessEqual(sketch.errors[command], len(stream) / sketch.capacity)
+        for command, true_count in true_counts.items():
+            if command not in sketch.counts:
+                self.assertLessEqual(true_count, sketch.minimum(), command)
+
+    def test_bounds(self):
+        stream = command_stream(50000)
+        self.assertBounds(self.build(stream, 100), stream)
+
+    def test_exact_below_capacity(self):
+        stream = command_stream(5000, distinct=40)
+        sketch = self.build(stream, 100)
+        self.assertEqual(sketch.counts, dict(Counter(stream)))
+        self.assertEqual(set(sketch.errors.values()), {0})
+
+    def test_merge_bounds(self):
+        stream = command_stream(50000, seed=1)
+        sketches = [self.build(part, 100) for part in split(stream, 4)]
+        merged = sketches[0]
+        for sketch in sketches[1:]:
+            merged.merge(sketch)
+        self.assertLessEqual(len(merged.counts), 100)
+        self.assertBounds(merged, stream)
+        # The heaviest commands are far above the error and must survive the merge
+        top = [command for command, _ in Counter(stream).most_common(5)]
+        self.assertEqual([command for command, _ in merged.most_common(5)], top)
+
+    def test_add_after_merge(self):
+        # Merging rebuilds the heap the next eviction relies on
+        stream = command_stream(30000, seed=2)
+        merged = self.build(stream[:10000], 50).merge(self.build(stream[10000:20000], 50))
+        for command in stream[20000:]:
+            merged.add(command)
+        self.assertBounds(merged, stream)
+
+class CountMinSketchTests(unittest.TestCase):
+    def build(self, stream):
+        sketch = freq.CountMinSketch()
+        for command in stream:
+            sketch.add_hash(freq.hash_command(command))
+        return sketch
+
+    def test_bounds(self):
+        stream = command_stream(50000)
+        sketch = self.build(stream)
+        true_counts = Counter(stream)
+        over = 0
+        for command, true_count in true_counts.items():
+            estimate = sketch.estimate(command)
+            self.assertGreaterEqual(estimate, true_count, command)
+            over += estimate - true_count > sketch.error_bound()
+        # The bound holds with probability 1 - e^-5 per command
+        self.assertLessEqual(over, 0.02 * len(true_counts))
+        self.assertEqual(sketch.estimate("never run"), 0)
+
+    def test_merge_is_exact(self):
+        stream = command_stream(20000, seed=3)
+        merged = self.build(stream[:7000]).merge(self.build(stream[7000:]))
+        whole = self.build(stream)
+        self.assertEqual(merged.counters, whole.counters)
+        self.assertEqual(merged.total, whole.total)
+
+class HyperLogLogTests(unittest.TestCase):
+    def build(self, commands):
+        sketch = freq.HyperLogLog()
+        for command in commands:
+            sketch.add_hash(freq.hash_command(command))
+        return sketch
+
+    def test_estimates(self):
+        # About 1.6% standard error; small counts go through the linear-counting correction
+        for distinct in [10, 100, 1000, 20000]:
+            with self.subTest(distinct=distinct):
+                estimate = self.build(f"command {i}" for i in range(distinct)).estimate()
+                self.assertLessEqual(abs(estimate - distinct), max(2, 0.05 * distinct))
+        self.assertEqual(self.build([]).estimate(), 0)
+
+    def test_merge_is_union(self):
+        first = [f"command {i}" for i in range(0, 6000)]
+        second = [f"command {i}" for i in range(4000, 12000)]
+        merged = self.build(first).merge(self.build(second))
+        self.assertEqual(merged.registers, self.build(first + second).registers)
+
+class DistinctSampleTests(unittest.TestCase):
+    def build(self, stream, size=freq.DISTINCT_SAMPLE_SIZE):
+        sample = freq.DistinctSample(size)
+        for command in stream:
+            sample.add_hash(freq.hash_command(command))
+        return sample
+
+    def test_counts_are_exact(self):
+        stream = command_stream(30000)
+        sample = self.build(stream, 64)
+        self.assertFalse(sample.complete)
+        true_counts = Counter(map(freq.hash_command, stream))
+        self.assertEqual(sample.counts, {hashed: true_counts[hashed] for hashed in sorted(true_counts)[:64]})
+
+    def test_merge_equals_sample_of_whole(self):
+        stream = command_stream(30000, seed=4)
+        for size in [64, 5000]:
+            with self.subTest(size=size):
+                parts = [self.build(part, size) for part in split(stream, 3)]
+                merged = parts[0].merge(parts[1]).merge(parts[2])
+                whole = self.build(stream, size)
+                self.assertEqual(merged.counts, whole.counts)
+                self.assertEqual(merged.complete, whole.complete)
+
+class CommandSketchTests(unittest.TestCase):
+    def build(self, stream, capacity=100):
+        stats = freq.aggregate_history_approx(((command, 1700000000 + i, 0) for i, command in enumerate(stream)),
+                                              daily=False, capacity=capacity)
+        return stats
+
+    def assertBounds(self, stats, stream):
+        true_counts = Counter(stream)
+        self.assertEqual(stats.total, len(stream))
+        for command, count in stats.most_common(20):
+            error = stats.count_error(command)
+            self.assertLessEqual(count - error, true_counts[command], command)
+            self.assertLessEqual(true_counts[command], count, command)
+
+    def test_bounds(self):
+        stream = command_stream(50000)
+        self.assertBounds(self.build(stream), stream)
+
+    def test_merged_bounds(self):
+        # As the -j workers' partial aggregates are merged, in file order
+        stream = command_stream(50000, seed=5)
+        merged = freq.HistoryStats()
+        for part in split(stream, 4):
+            merged.merge(self.build(part))
+        self.assertBounds(merged, stream)
+
+    def test_diversity(self):
+        stream = command_stream(50000, seed=6)
+        true_counts = Counter(stream)
+        single_use = sum(1 for count in true_counts.values() if count == 1)
+        merged = freq.HistoryStats()
+        for part in split(stream, 4):
+            merged.merge(self.build(part))
+        for stats in [self.build(stream), merged]:
+            self.assertFalse(stats.sketch.exact_diversity)
+            self.assertLessEqual(abs(stats.unique_commands - len(true_counts)), 0.05 * len(true_counts))
+            self.assertLessEqual(abs(stats.single_use_commands - single_use), 0.25 * single_use)
+
+    def test_exact_diversity(self):
+        # A sample that never filled up saw every command, so the figures are exact
+        stream = command_stream(5000, distinct=200, seed=7)
+        stats = self.build(stream)
+        true_counts = Counter(stream)
+        self.assertTrue(stats.sketch.exact_diversity)
+        self.assertEqual(stats.unique_commands, len(true_counts))
+        self.assertEqual(stats.single_use_commands, sum(1 for count in true_counts.values() if count == 1))
+
+if __name__ == '__main__':
+    unittest.main()